@@ -1,11 +1,25 @@
 import argparse
+import atexit
 from pathlib import Path
 
-from . import ops
+from . import ops  # loads the modules of a command when it runs, see ops._lazy
+
+
+def positive_int(s: str) -> int:
+    value = int(s)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f'{s} is not a positive integer')
+    return value
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the time spent per phase and counters of hashes, signatures, blocks and bytes')
+    parser.add_argument('--profile-out', required=False,
+                        help='Also save cProfile stats of the command to this file (for pstats)')
+    parser.add_argument('--trusted-signer', action='append', default=[], required=False,
+                        help='Address of a wallet whose chain snapshots are trusted, may be repeated')
     subparsers = parser.add_subparsers(title='command', dest='command')
 
     wallet_parser = subparsers.add_parser(name='wallet')
@@ -13,6 +27,16 @@ if __name__ == '__main__':
     wallet_create_parser = wallet_subparsers.add_parser(name='create', help='Create new wallet')
     wallet_create_parser.add_argument('--path', help='Where to save wallet information',
                                       default='wallet.wal', required=False)
+    wallet_create_batch_parser = wallet_subparsers.add_parser(name='create-batch', help='Create many wallets at once')
+    wallet_create_batch_parser.add_argument('--count', type=positive_int, help='Number of wallets', required=True)
+    wallet_create_batch_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                            help='Number of processes generating keys')
+    wallet_create_batch_parser.add_argument('--out', help='Directory to save the wallets in',
+                                            default='wallets', required=False)
+    wallet_create_batch_parser.add_argument('--keystore', action='store_true',
+                                            help='Save all keys to the single file --out instead of a directory')
+    wallet_create_batch_parser.add_argument('--force', action='store_true',
+                                            help='Overwrite the wallets and index already at --out')
     wallet_info_parser = wallet_subparsers.add_parser(name='info', help='Get wallet info')
     wallet_info_parser.add_argument('--wallet', help='Path to wallet file',)
 
@@ -23,16 +47,79 @@ if __name__ == '__main__':
                                      default='chain.json', required=False)
     chain_create_parser.add_argument('--wallet', help='Wallet to use',
                                      default='wallet.wal', required=False)
+    chain_create_parser.add_argument('--format', help='Storage format of the chain file',
+                                     choices=['json', 'binary'], default='json', required=False)
     chain_info_parser = chain_subparsers.add_parser(name='info', help='Get blockchain info')
     chain_info_parser.add_argument('--chain', help='Path to chain file',
                                    default='chain.json', required=False)
     chain_info_parser.add_argument('--block-limit', type=int, default=-1, required=False,
                                    help='Number of first blocks to check (-1 to check all)')
+    chain_info_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                   help='Number of processes verifying signatures')
+    chain_info_parser.add_argument('--node', required=False,
+                                   help='Address (host:port) of a running node to use instead of the chain file')
+    chain_info_parser.add_argument('--engine', choices=['python', 'numpy'], default='python', required=False,
+                                   help='How balances are computed (numpy: columnar, needs numpy installed)')
+    chain_status_parser = chain_subparsers.add_parser(name='status',
+                                                      help='Print length, tip hash and validity of a chain')
+    chain_status_parser.add_argument('--chain', help='Path to chain file',
+                                     default='chain.json', required=False)
+    chain_status_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                     help='Number of processes verifying signatures if the chain changed')
+    chain_verify_parser = chain_subparsers.add_parser(name='verify', help='Verify chain file block by block')
+    chain_verify_parser.add_argument('--chain', help='Path to chain file',
+                                     default='chain.json', required=False)
+    chain_verify_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                     help='Number of processes verifying signatures')
+    chain_verify_parser.add_argument('--progress', action='store_true',
+                                     help='Report throughput while verifying')
+    chain_verify_parser.add_argument('--headers-only', action='store_true',
+                                     help='Only check that blocks link up and satisfy the proof of work')
     chain_mine_parser = chain_subparsers.add_parser(name='mine', help='Mine new block')
     chain_mine_parser.add_argument('--chain', help='Path to chain file',
                                    default='chain.json', required=False)
     chain_mine_parser.add_argument('--wallet', help='Wallet to use',
                                    default='wallet.wal', required=False)
+    chain_mine_parser.add_argument('--workers', type=positive_int, default=1, required=False,
+                                   help='Number of mining processes')
+    chain_mine_parser.add_argument('--batch-size', type=positive_int, required=False,
+                                   help='Number of nonces a worker checks between stop checks')
+    chain_mine_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                   help='Number of processes verifying signatures')
+    chain_mine_parser.add_argument('--node', required=False,
+                                   help='Address (host:port) of a running node to use instead of the chain file')
+    chain_snapshot_parser = chain_subparsers.add_parser(name='snapshot', help='Sign the balances of a chain prefix')
+    chain_snapshot_parser.add_argument('--chain', help='Path to chain file',
+                                       default='chain.json', required=False)
+    chain_snapshot_parser.add_argument('--wallet', help='Wallet signing the snapshot',
+                                       default='wallet.wal', required=False)
+    chain_snapshot_parser.add_argument('--height', type=int, required=False,
+                                       help='Number of blocks covered (default: all mined blocks)')
+    chain_snapshot_parser.add_argument('--prune', action='store_true',
+                                       help='Drop the transactions of the covered blocks from the block store')
+    chain_snapshot_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                       help='Number of processes verifying signatures')
+    chain_sync_parser = chain_subparsers.add_parser(name='sync', help='Fetch missing blocks from running nodes')
+    chain_sync_parser.add_argument('--chain', help='Path to chain file',
+                                   default='chain.json', required=False)
+    chain_sync_parser.add_argument('--peers', nargs='+', required=True,
+                                   help='Addresses (host:port) of the nodes to sync from')
+    chain_sync_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                   help='Number of processes verifying signatures')
+    chain_sync_parser.add_argument('--batch-size', type=positive_int, required=False,
+                                   help='Number of blocks per request')
+    chain_sync_parser.add_argument('--depth', type=positive_int, required=False,
+                                   help='Number of requests in flight per peer')
+    chain_sync_parser.add_argument('--progress', action='store_true',
+                                   help='Report the height while syncing')
+    chain_export_parser = chain_subparsers.add_parser(name='export', help='Export blockchain to JSON')
+    chain_export_parser.add_argument('--chain', help='Path to chain file',
+                                     default='chain.json', required=False)
+    chain_export_parser.add_argument('--out', help='Where to save the JSON chain', required=True)
+    chain_import_parser = chain_subparsers.add_parser(name='import', help='Import JSON blockchain into a block store')
+    chain_import_parser.add_argument('--json', help='Path to JSON chain file',
+                                     default='chain.json', required=False)
+    chain_import_parser.add_argument('--out', help='Where to save the block store', required=True)
 
     transaction_parser = subparsers.add_parser(name='transaction')
     transaction_subparsers = transaction_parser.add_subparsers(title='transaction command', dest='transaction_command')
@@ -43,14 +130,139 @@ if __name__ == '__main__':
                                            default='chain.json', required=False)
     transaction_create_parser.add_argument('--receiver', help='Public address of receiver',)
     transaction_create_parser.add_argument('--amount', type=int, help='Amount to send',)
+    transaction_create_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                           help='Number of processes verifying signatures')
+    transaction_create_parser.add_argument('--out', required=False,
+                                           help='Append the signed transaction to this JSONL file '
+                                                'instead of adding it to the chain')
+    transaction_create_parser.add_argument('--node', required=False,
+                                           help='Address (host:port) of a running node to use instead of the chain file')
+    transaction_create_batch_parser = transaction_subparsers.add_parser(name='create-batch',
+                                                                        help='Create transactions from a list of payouts')
+    transaction_create_batch_parser.add_argument('--wallet', help='Path to wallet',
+                                                 default='wallet.wal', required=False)
+    transaction_create_batch_parser.add_argument('--chain', help='Path to chain file',
+                                                 default='chain.json', required=False)
+    transaction_create_batch_parser.add_argument('--input', help='CSV (receiver,amount) or JSONL file of payouts',
+                                                 required=True)
+    transaction_create_batch_parser.add_argument('--format', choices=['csv', 'jsonl'], required=False,
+                                                 help='Format of the input (default: from its extension)')
+    transaction_create_batch_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                                 help='Number of processes signing and verifying signatures')
+    transaction_create_batch_parser.add_argument('--out', required=False,
+                                                 help='Append the signed transactions to this JSONL file '
+                                                      'instead of adding them to the chain')
+    transaction_create_batch_parser.add_argument('--node', required=False,
+                                                 help='Address (host:port) of a running node to use instead of the chain file')
+    transaction_submit_parser = transaction_subparsers.add_parser(name='submit-batch',
+                                                                  help='Add signed transactions from JSONL')
+    transaction_submit_parser.add_argument('--chain', help='Path to chain file',
+                                           default='chain.json', required=False)
+    transaction_submit_parser.add_argument('--input', help='JSONL file with transactions (- for stdin)',
+                                           default='-', required=False)
+    transaction_submit_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                           help='Number of processes verifying signatures')
+    transaction_proof_parser = transaction_subparsers.add_parser(name='proof',
+                                                                 help='Create inclusion proof of a transaction')
+    transaction_proof_parser.add_argument('--chain', help='Path to chain file',
+                                          default='chain.json', required=False)
+    transaction_proof_parser.add_argument('--block', type=int, help='Height of the block', required=True)
+    transaction_proof_parser.add_argument('--index', type=int, help='Index of the transaction in the block',
+                                          required=True)
+    transaction_proof_parser.add_argument('--out', help='Where to save the proof (default: print it)',
+                                          required=False)
+    transaction_verify_proof_parser = transaction_subparsers.add_parser(name='verify-proof',
+                                                                        help='Check inclusion proof of a transaction')
+    transaction_verify_proof_parser.add_argument('--proof', help='Path to proof file', required=True)
+    transaction_get_parser = transaction_subparsers.add_parser(name='get', help='Find transaction by hash')
+    transaction_get_parser.add_argument('--chain', help='Path to chain file',
+                                        default='chain.json', required=False)
+    transaction_get_parser.add_argument('--hash', help='Hash of the transaction', required=True)
+
+    address_parser = subparsers.add_parser(name='address')
+    address_subparsers = address_parser.add_subparsers(title='address command', dest='address_command')
+    address_balance_parser = address_subparsers.add_parser(name='balance', help='Print the balance of an address')
+    address_balance_parser.add_argument('--chain', help='Path to chain file',
+                                        default='chain.json', required=False)
+    address_balance_parser.add_argument('--address', help='Address to look up', required=True)
+    address_balance_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                        help='Number of processes verifying signatures if the chain changed')
+    address_history_parser = address_subparsers.add_parser(name='history', help='List transactions of an address')
+    address_history_parser.add_argument('--chain', help='Path to chain file',
+                                        default='chain.json', required=False)
+    address_history_parser.add_argument('--address', help='Address to look up', required=True)
+
+    node_parser = subparsers.add_parser(name='node')
+    node_subparsers = node_parser.add_subparsers(title='node command', dest='node_command')
+    node_serve_parser = node_subparsers.add_parser(name='serve', help='Serve a chain to local clients')
+    node_serve_parser.add_argument('--chain', help='Path to chain file',
+                                   default='chain.json', required=False)
+    node_serve_parser.add_argument('--host', help='Interface to listen on', required=False)
+    node_serve_parser.add_argument('--port', type=int, help='Port to listen on', required=False)
+    node_serve_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                                   help='Number of processes verifying signatures')
+    node_serve_parser.add_argument('--mine', help='Wallet to mine with in the background, '
+                                                  'sealing blocks while transactions are accepted',
+                                   required=False)
+    node_serve_parser.add_argument('--workers', type=positive_int, default=1, required=False,
+                                   help='Number of mining processes')
+    node_serve_parser.add_argument('--batch-size', type=positive_int, required=False,
+                                   help='Number of nonces a worker checks between stop checks')
+    node_bench_parser = node_subparsers.add_parser(name='bench', help='Load test a running node')
+    node_bench_parser.add_argument('--node', help='Address (host:port) of the node', required=False)
+    node_bench_parser.add_argument('--clients', type=positive_int, default=8, required=False,
+                                   help='Number of concurrent connections')
+    node_bench_parser.add_argument('--requests', type=positive_int, default=100, required=False,
+                                   help='Number of requests per connection')
+    node_bench_parser.add_argument('--method', choices=['info', 'balance', 'block'],
+                                   default='info', required=False, help='Request to send')
+    node_bench_parser.add_argument('--address', required=False, help='Address for balance requests')
+    node_bench_parser.add_argument('--height', type=int, default=0, required=False,
+                                   help='Block height for block requests')
+
+    bench_parser = subparsers.add_parser(name='bench', help='Benchmark hot paths on a synthetic chain')
+    bench_parser.add_argument('--only', nargs='+', required=False,
+                              help='Benchmarks to run (default: all)')
+    bench_parser.add_argument('--blocks', type=positive_int, default=20, required=False,
+                              help='Number of blocks of the synthetic chain')
+    bench_parser.add_argument('--transactions', type=positive_int, default=50, required=False,
+                              help='Number of transactions per block')
+    bench_parser.add_argument('--wallets', type=positive_int, default=8, required=False,
+                              help='Number of wallets trading with each other')
+    bench_parser.add_argument('--jobs', type=positive_int, default=1, required=False,
+                              help='Number of processes verifying signatures')
+    bench_parser.add_argument('--repeat', type=positive_int, default=3, required=False,
+                              help='Number of runs of each benchmark, the best one is reported')
+    bench_parser.add_argument('--hashes', type=positive_int, default=200000, required=False,
+                              help='Number of nonces to try in each mining loop')
+    bench_parser.add_argument('--fixtures', required=False,
+                              help='Where to cache the generated chains')
+    bench_parser.add_argument('--out', required=False, help='Where to save the JSON results (default: print them)')
+    bench_parser.add_argument('--peers', type=positive_int, default=3, required=False,
+                              help='Number of local nodes to sync from')
 
     args = parser.parse_args()
 
+    if args.profile or args.profile_out is not None:
+        from . import profiling
+        profiling.start(p_stats=Path(args.profile_out) if args.profile_out is not None else None)
+        atexit.register(profiling.finish)
+    if args.trusted_signer:
+        ops.trust_signers(args.trusted_signer)
+
     if args.command == 'wallet':
         if args.wallet_command == 'create':
             ops.wallet_create(
                 path=Path(args.path),
             )
+        elif args.wallet_command == 'create-batch':
+            ops.wallet_create_batch(
+                dest=Path(args.out),
+                count=args.count,
+                jobs=args.jobs,
+                keystore=args.keystore,
+                force=args.force,
+            )
         elif args.wallet_command == 'info':
             ops.wallet_info(
                 p_wallet=Path(args.wallet),
@@ -62,16 +274,63 @@ if __name__ == '__main__':
             ops.chain_create(
                 dest=Path(args.path),
                 p_wallet=Path(args.wallet),
+                binary=args.format == 'binary',
             )
         elif args.chain_command == 'info':
             ops.chain_info(
                 p_chain=Path(args.chain),
                 block_limit=args.block_limit,
+                jobs=args.jobs,
+                node_address=args.node,
+                engine=args.engine,
+            )
+        elif args.chain_command == 'status':
+            ops.chain_status(
+                p_chain=Path(args.chain),
+                jobs=args.jobs,
+            )
+        elif args.chain_command == 'verify':
+            ops.chain_verify(
+                p_chain=Path(args.chain),
+                jobs=args.jobs,
+                progress=args.progress,
+                headers_only=args.headers_only,
             )
         elif args.chain_command == 'mine':
             ops.chain_mine(
                 p_wallet=Path(args.wallet),
                 p_chain=Path(args.chain),
+                workers=args.workers,
+                batch_size=args.batch_size,
+                jobs=args.jobs,
+                node_address=args.node,
+            )
+        elif args.chain_command == 'snapshot':
+            ops.chain_snapshot(
+                p_chain=Path(args.chain),
+                p_wallet=Path(args.wallet),
+                height=args.height,
+                prune=args.prune,
+                jobs=args.jobs,
+            )
+        elif args.chain_command == 'sync':
+            ops.chain_sync(
+                p_chain=Path(args.chain),
+                peers=args.peers,
+                jobs=args.jobs,
+                batch_size=args.batch_size,
+                depth=args.depth,
+                progress=args.progress,
+            )
+        elif args.chain_command == 'export':
+            ops.chain_export(
+                p_chain=Path(args.chain),
+                dest=Path(args.out),
+            )
+        elif args.chain_command == 'import':
+            ops.chain_import(
+                p_json=Path(args.json),
+                dest=Path(args.out),
             )
         else:
             chain_parser.print_help()
@@ -82,8 +341,96 @@ if __name__ == '__main__':
                 p_chain=Path(args.chain),
                 receiver=args.receiver,
                 amount=args.amount,
+                jobs=args.jobs,
+                dest=Path(args.out) if args.out is not None else None,
+                node_address=args.node,
+            )
+        elif args.transaction_command == 'create-batch':
+            ops.transaction_create_batch(
+                p_wallet=Path(args.wallet),
+                p_chain=Path(args.chain),
+                source=Path(args.input),
+                fmt=args.format,
+                jobs=args.jobs,
+                dest=Path(args.out) if args.out is not None else None,
+                node_address=args.node,
+            )
+        elif args.transaction_command == 'submit-batch':
+            ops.transaction_submit_batch(
+                p_chain=Path(args.chain),
+                source=Path(args.input) if args.input != '-' else None,
+                jobs=args.jobs,
+            )
+        elif args.transaction_command == 'proof':
+            ops.transaction_proof(
+                p_chain=Path(args.chain),
+                height=args.block,
+                index=args.index,
+                dest=Path(args.out) if args.out is not None else None,
+            )
+        elif args.transaction_command == 'verify-proof':
+            ops.transaction_verify_proof(
+                p_proof=Path(args.proof),
+            )
+        elif args.transaction_command == 'get':
+            ops.transaction_get(
+                p_chain=Path(args.chain),
+                b64_hash=args.hash,
             )
         else:
             transaction_parser.print_help()
+    elif args.command == 'address':
+        if args.address_command == 'balance':
+            ops.address_balance(
+                p_chain=Path(args.chain),
+                address=args.address,
+                jobs=args.jobs,
+            )
+        elif args.address_command == 'history':
+            ops.address_history(
+                p_chain=Path(args.chain),
+                address=args.address,
+            )
+        else:
+            address_parser.print_help()
+    elif args.command == 'node':
+        if args.node_command == 'serve':
+            ops.node_serve(
+                p_chain=Path(args.chain),
+                host=args.host,
+                port=args.port,
+                jobs=args.jobs,
+                p_wallet=Path(args.mine) if args.mine is not None else None,
+                workers=args.workers,
+                batch_size=args.batch_size,
+            )
+        elif args.node_command == 'bench':
+            ops.node_bench(
+                node_address=args.node,
+                clients=args.clients,
+                requests=args.requests,
+                method=args.method,
+                address=args.address,
+                height=args.height,
+            )
+        else:
+            node_parser.print_help()
+    elif args.command == 'bench':
+        unknown = [name for name in args.only or [] if name not in ops.bench.BENCHMARKS]
+        if unknown:
+            bench_parser.error(f"argument --only: invalid choice: '{unknown[0]}' "
+                               f"(choose from {', '.join(ops.bench.BENCHMARKS)})")
+        ops.bench_run(
+            only=args.only,
+            n_wallets=args.wallets,
+            n_blocks=args.blocks,
+            n_transactions=args.transactions,
+            jobs=args.jobs,
+            repeat=args.repeat,
+            fixtures_dir=Path(args.fixtures) if args.fixtures is not None else None,
+            dest=Path(args.out) if args.out is not None else None,
+            n_peers=args.peers,
+            hashes=args.hashes,
+        )
     else:
         parser.print_help()
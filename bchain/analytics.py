@@ -0,0 +1,113 @@
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from .chain import Chain, MINING_REWARD
+from .ledger import Ledger
+from .store import LazyBlocks
+
+
+# Columnar engine for the balance statistics of `chain info`. The balance changes of a
+# chain are loaded once into arrays, one row per change: address id, signed amount and
+# block height. Balances (current, min, max) of every address over any prefix of blocks
+# are then computed at once with grouped cumulative sums. numpy is an optional dependency,
+# only imported here.
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('The numpy engine requires numpy (pip install numpy)') from None
+    return numpy
+
+
+def _transfers(blocks) -> Iterator[Tuple[Optional[str], List[Tuple[Optional[str], Optional[str], int]]]]:
+    # miner (None if not mined) and (sender, receiver, amount) of every block.
+    # block stores are read without decoding whole transactions
+    if isinstance(blocks, LazyBlocks):
+        yield from blocks.iter_transfers()
+        return
+    for block in blocks:
+        yield block.b64_miner if block.is_mined else None, \
+            [(t.b64_sender, t.b64_receiver, t.amount) for t in block.transactions]
+
+
+class Columns(NamedTuple):
+    base: Ledger  # state before the first row
+    height: int  # blocks covered: the mined prefix of the chain
+    addresses: List[str]  # by id, in order of first appearance like the keys of a Ledger
+    ids: 'numpy.ndarray'
+    deltas: 'numpy.ndarray'
+    heights: 'numpy.ndarray'  # ascending
+
+    @staticmethod
+    def fromchain(c: Chain) -> 'Columns':
+        np = _numpy()
+        base = c.base if c.base is not None else Ledger(MINING_REWARD)
+        addresses = list(base.todict()['balances'])
+        index = {address: i for i, address in enumerate(addresses)}
+        ids: List[int] = []
+        deltas: List[int] = []
+        counts: List[int] = []  # rows per block
+        height = base.height
+        for b64_miner, transfers in _transfers(c.blocks[base.height:]):
+            if b64_miner is None:
+                break
+            n = len(ids)
+            # same order of changes as Ledger.apply_block
+            for b64_sender, b64_receiver, amount in transfers:
+                sender = index.setdefault(b64_sender, len(index))
+                receiver = index.setdefault(b64_receiver, len(index))
+                if sender == receiver:  # both changes at once, the bounds only see the sum
+                    ids.append(sender)
+                    deltas.append(0)
+                else:
+                    ids += sender, receiver
+                    deltas += -amount, amount
+            ids.append(index.setdefault(b64_miner, len(index)))
+            deltas.append(base.mining_reward)
+            counts.append(len(ids) - n)
+            height += 1
+        addresses.extend(list(index)[len(addresses):])
+        return Columns(
+            base=base,
+            height=height,
+            addresses=addresses,
+            ids=np.array(ids, dtype=np.int64),
+            deltas=np.array(deltas, dtype=np.int64),
+            heights=np.repeat(np.arange(base.height, height, dtype=np.int64), counts),
+        )
+
+    def ledger(self, n: int) -> Ledger:
+        # state after the first n blocks, without scanning the chain again
+        np = _numpy()
+        assert n >= self.base.height
+        n = min(n, self.height)
+        stop = int(np.searchsorted(self.heights, n))
+        if stop == 0:
+            return self.base.copy()
+        ids, deltas = self.ids[:stop], self.deltas[:stop]
+        n_addresses = max(len(self.base.addresses), int(ids.max()) + 1)  # ids are given in order
+
+        bounds = np.zeros((3, n_addresses), dtype=np.int64)  # current, min, max
+        for i, account in enumerate(self.base.todict()['balances'].values()):
+            bounds[:, i] = account
+
+        # rows of every address together, each group in chain order
+        order = np.argsort(ids, kind='stable')
+        ids, deltas = ids[order], deltas[order]
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+        ends = np.append(starts[1:], len(ids))
+        present = ids[starts]
+
+        # running balances: cumulative sums restarted at every group, from the initial balance
+        balances = np.cumsum(deltas)
+        offsets = bounds[0, present] - (balances[starts] - deltas[starts])
+        balances += np.repeat(offsets, ends - starts)
+
+        bounds[0, present] = balances[ends - 1]
+        bounds[1, present] = np.minimum(bounds[1, present], np.minimum.reduceat(balances, starts))
+        bounds[2, present] = np.maximum(bounds[2, present], np.maximum.reduceat(balances, starts))
+        return Ledger.fromdict({
+            'height': n,
+            'mining_reward': self.base.mining_reward,
+            'balances': dict(zip(self.addresses[:n_addresses], bounds.T.tolist())),
+        })
@@ -0,0 +1,86 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from . import miner
+from .block import Block
+from .chain import Chain
+
+
+class BackgroundMiner(threading.Thread):
+    # mines the open block of a chain while transactions keep coming in.
+    # the miner works on a snapshot of the open block taken under `lock`; transactions
+    # added meanwhile stay in the open block and go to the next block once the snapshot
+    # is sealed (Chain.seal, under `lock` as well). every change to the chain must hold `lock`
+    def __init__(
+            self,
+            c: Chain,
+            lock: threading.Lock,
+            b64_miner: str,
+            workers: int = 1,
+            batch_size: int = miner.DEFAULT_BATCH_SIZE,
+            min_transactions: int = 1,
+            on_sealed: Optional[Callable[[Block], None]] = None,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.chain = c
+        self.lock = lock
+        self.b64_miner = b64_miner
+        self.workers = workers
+        self.batch_size = batch_size
+        self.min_transactions = min_transactions
+        self.on_sealed = on_sealed  # called with the sealed block, still holding `lock`
+        self.blocks_mined = 0
+        self.transactions_mined = 0
+        self.hashes = 0
+        self._start_time: Optional[float] = None
+        self._wakeup = threading.Event()
+        self._cancel = threading.Event()
+
+    def notify(self) -> None:
+        # transactions were added to the open block
+        self._wakeup.set()
+
+    def stop(self) -> None:
+        self._cancel.set()
+        self._wakeup.set()
+        self.join()
+
+    def _take_snapshot(self) -> Optional[Block]:
+        with self.lock:
+            open_block = self.chain.last_block
+            if open_block.is_mined or len(open_block.transactions) < self.min_transactions:
+                return None
+            return open_block.snapshot()
+
+    def run(self) -> None:
+        self._start_time = time.perf_counter()
+        while not self._cancel.is_set():
+            self._wakeup.clear()
+            block = self._take_snapshot()
+            if block is None:
+                self._wakeup.wait()
+                continue
+            result = block.mine(self.b64_miner, workers=self.workers, batch_size=self.batch_size, cancel=self._cancel)
+            if result is None:
+                break
+            with self.lock:
+                self.chain.seal(block)
+                self.blocks_mined += 1
+                self.transactions_mined += len(block.transactions)
+                self.hashes += result.hashes
+                if self.on_sealed is not None:
+                    self.on_sealed(block)
+
+    @property
+    def stats(self) -> Dict:
+        # sustained rates since the miner started
+        seconds = time.perf_counter() - self._start_time if self._start_time is not None else 0.
+        return {
+            'blocks': self.blocks_mined,
+            'transactions': self.transactions_mined,
+            'hashes': self.hashes,
+            'seconds': seconds,
+            'blocks_per_min': self.blocks_mined * 60 / seconds if seconds > 0 else 0.,
+            'transactions_per_sec': self.transactions_mined / seconds if seconds > 0 else 0.,
+        }
@@ -0,0 +1,377 @@
+import asyncio
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from . import block, chain, keycache, mempool, miner, merkle, store, stream, sync, transaction, wallet
+
+
+# Benchmarks of the hot paths, on synthetic chains cached as fixtures so that runs are
+# comparable with each other. Every benchmark returns a dict, the suite prints them as JSON.
+
+FIXTURES_DIR = Path('.bench')
+SEED = 1
+
+
+class Fixture(NamedTuple):
+    path: Path  # directory of the fixture
+    wallets: List[wallet.Wallet]
+
+    @property
+    def p_json(self) -> Path:
+        return self.path / 'chain.json'
+
+    @property
+    def p_store(self) -> Path:
+        return self.path / 'chain.bch'
+
+    def p_wallet(self, i: int) -> Path:
+        return self.path / f'wallet-{i}.wal'
+
+    @property
+    def p_pending(self) -> Path:
+        # signed transactions not in the chain, for admission
+        return self.path / 'pending.jsonl'
+
+
+def _transfers(
+        rng: random.Random,
+        wallets: List[wallet.Wallet],
+        balances: Dict[str, int],
+        n: int,
+) -> List[transaction.Transaction]:
+    # up to n signed transfers between the wallets, spending from the given balances.
+    # receivers are not credited, funds received in an open block can not be spent yet
+    res = []
+    for _ in range(n):
+        senders = [w for w in wallets if balances[w.b64_address] > 0]
+        if not senders:
+            break
+        sender = rng.choice(senders)
+        amount = rng.randint(1, min(10, balances[sender.b64_address]))
+        balances[sender.b64_address] -= amount
+        t = transaction.Transaction(sender.b64_address, rng.choice(wallets).b64_address, amount)
+        t.sign(sender)
+        res.append(t)
+    return res
+
+
+def fixture(
+        n_wallets: int = 8,
+        n_blocks: int = 20,
+        n_transactions: int = 50,
+        fixtures_dir: Path = FIXTURES_DIR,
+) -> Fixture:
+    # chain of n_blocks mined blocks after the genesis, n_transactions transfers each,
+    # generated on first use and cached in fixtures_dir
+    path = fixtures_dir / f'chain-{n_wallets}w-{n_blocks}b-{n_transactions}t'
+    f = Fixture(path, [])
+    p_wallets = [f.p_wallet(i) for i in range(n_wallets)]
+    if f.p_pending.exists():
+        return f._replace(wallets=[wallet.Wallet.from_file(p) for p in p_wallets])
+
+    rng = random.Random(SEED)
+    wallets = [wallet.Wallet.generate() for _ in range(n_wallets)]
+    balances = {w.b64_address: 0 for w in wallets}
+    c = chain.Chain.new_chain(wallets[0].b64_address)
+    balances[wallets[0].b64_address] += chain.MINING_REWARD
+    for i in range(n_blocks):
+        transactions = _transfers(rng, wallets, balances, n_transactions)
+        for t in transactions:
+            c.add_transaction(t)
+        if c.last_block.is_mined:  # no transactions
+            c.blocks.append(block.Block(prev_block=c.last_block))
+        b64_miner = wallets[(i + 1) % n_wallets].b64_address
+        c.last_block.mine(b64_miner)
+        for t in transactions:
+            balances[t.b64_receiver] += t.amount
+        balances[b64_miner] += chain.MINING_REWARD
+    pending = _transfers(rng, wallets, balances, n_transactions)
+
+    path.mkdir(parents=True, exist_ok=True)
+    for w, p in zip(wallets, p_wallets):
+        w.to_file(p)
+    c.to_file(f.p_json)
+    store.BlockStore.create(f.p_store, c).close()
+    with open(f.p_pending, 'w') as out:  # written last, marks the fixture complete
+        for t in pending:
+            out.write(json.dumps(t.todict()) + '\n')
+    return f._replace(wallets=wallets)
+
+
+def _best(fn: Callable[[Any], Any], repeat: int, setup: Callable[[], Any] = lambda: None) -> float:
+    # best time of `repeat` runs, the least disturbed by the rest of the system.
+    # what setup returns is passed to fn and not timed
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        started = time.perf_counter()
+        fn(arg)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def _cold(arg: Any = None) -> Any:
+    # setup of runs that check signatures: the results of earlier runs are memoised
+    # process-wide (see keycache), every run starts without them
+    keycache.clear()
+    return arg
+
+
+def _load(f: Fixture) -> chain.Chain:
+    return chain.Chain.from_file(f.p_json)
+
+
+def _count_transactions(c: chain.Chain) -> int:
+    return sum(len(b.transactions) for b in c.blocks)
+
+
+################################################################################
+#  Benchmarks
+################################################################################
+
+def bench_mining_loop(n: int = 200000) -> Dict:
+    # hashes/sec of the per-attempt Block.is_proved loop vs the midstate fast path of bchain.miner
+    b = block.Block(b64_miner='-')
+    b._timestamp = '01-01-1970 00:00:00'
+
+    started = time.perf_counter()
+    for nonce in range(n):
+        b._nonce = nonce
+        b.invalidate_hash()
+        b.is_proved
+    t_block = time.perf_counter() - started
+
+    prefix = b._header_prefix('-').encode()
+    started = time.perf_counter()
+    miner._search(prefix, 64, 0, n)  # unreachable difficulty, scans all n nonces
+    t_midstate = time.perf_counter() - started
+
+    return {
+        'hashes': n,
+        'block_is_proved_hps': n / t_block,
+        'midstate_hps': n / t_midstate,
+        'speedup': t_block / t_midstate,
+    }
+
+
+def bench_verify(f: Fixture, jobs: int = 1, repeat: int = 3) -> Dict:
+    # full verification of a freshly loaded chain, in memory and streamed from the file
+    c = _load(f)
+    n_blocks, n_transactions = c.length, _count_transactions(c)
+    t_memory = _best(lambda c_: c_.verify(jobs=jobs), repeat, setup=lambda: _cold(_load(f)))
+    t_stream = _best(lambda _: stream.verify(f.p_store, jobs=jobs), repeat, setup=_cold)
+    return {
+        'jobs': jobs,
+        'blocks': n_blocks,
+        'transactions': n_transactions,
+        'verify_seconds': t_memory,
+        'verify_transactions_per_sec': n_transactions / t_memory,
+        'stream_seconds': t_stream,
+        'stream_transactions_per_sec': n_transactions / t_stream,
+    }
+
+
+def bench_load_save(f: Fixture, repeat: int = 3) -> Dict:
+    c = _load(f)
+    with tempfile.TemporaryDirectory() as tmp:
+        p_json = Path(tmp) / 'chain.json'
+        p_store = Path(tmp) / 'chain.bch'
+        return {
+            'json_load_seconds': _best(lambda _: _load(f), repeat),
+            'json_save_seconds': _best(lambda _: c.to_file(p_json), repeat),
+            'store_load_seconds': _best(lambda _: store.BlockStore(f.p_store).read_chain(), repeat),
+            'store_open_seconds': _best(lambda _: store.load(f.p_store), repeat),
+            'store_save_seconds': _best(lambda _: store.BlockStore.create(p_store, c).close(), repeat),
+            'json_bytes': f.p_json.stat().st_size,
+            'store_bytes': f.p_store.stat().st_size,
+        }
+
+
+def bench_balances(f: Fixture, repeat: int = 3) -> Dict:
+    # balance report of `chain info`, from a fresh ledger every time, and with the numpy engine
+    n_addresses = len(_load(f).addresses)
+    t = _best(lambda c: c.info(), repeat, setup=lambda: _load(f))
+    res = {
+        'addresses': n_addresses,
+        'seconds': t,
+        'addresses_per_sec': n_addresses / t,
+    }
+    try:
+        t_numpy = _best(lambda c: c.info(engine='numpy'), repeat, setup=lambda: _load(f))
+    except ImportError:  # numpy is optional
+        return res
+    res['numpy_seconds'] = t_numpy
+    res['numpy_speedup'] = t / t_numpy
+    return res
+
+
+def bench_admission(f: Fixture, jobs: int = 1, repeat: int = 3) -> Dict:
+    # Mempool.submit and flush of the pending transactions of the fixture
+    with open(f.p_pending, 'r') as pending:
+        dicts = [json.loads(line) for line in pending]
+
+    def setup() -> mempool.Mempool:
+        c = _load(f)
+        c.ledger  # built before, not part of the admission
+        return _cold(mempool.Mempool(c, jobs=jobs))
+
+    def admit(pool: mempool.Mempool) -> None:
+        assert all(r is None for r in pool.submit([transaction.Transaction.fromdict(d) for d in dicts]))
+        pool.flush()
+
+    t = _best(admit, repeat, setup=setup)
+    return {
+        'jobs': jobs,
+        'transactions': len(dicts),
+        'seconds': t,
+        'transactions_per_sec': len(dicts) / t,
+    }
+
+
+def bench_transaction_memory(n: int = 100000) -> Dict:
+    # memory held per loaded transaction, as MerkleTree.fromlist builds them from parsed JSON
+    w = wallet.Wallet.generate()
+    t = transaction.Transaction(w.b64_address, w.b64_address, 1)
+    t.sign(w)
+    template = json.dumps(merkle.MerkleNode(t).todict())
+
+    tracemalloc.start()
+    started = tracemalloc.get_traced_memory()[0]
+    nodes = []
+    for i in range(n):
+        d = json.loads(template)  # fresh strings, like a real JSON load
+        d['amount'] = i + 1
+        nodes.append(merkle.MerkleNode.fromdict(d, nodes[-1] if nodes else None))
+    del d
+    held = tracemalloc.get_traced_memory()[0] - started
+    tracemalloc.stop()
+
+    return {
+        'transactions': n,
+        'bytes': held,
+        'bytes_per_transaction': held / n,
+    }
+
+
+def bench_sync(f: Fixture, n_peers: int = 3, jobs: int = 1) -> Dict:
+    # blocks/sec synced from local node processes into a chain of only the genesis block
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(n_peers):
+            paths.append(Path(tmp) / f'peer-{i}.bch')
+            shutil.copy(f.p_store, paths[-1])
+        processes, addresses = sync.start_peers(paths)
+        try:
+            c = chain.Chain([_load(f).blocks[0]])
+            result = asyncio.run(sync.sync(c, addresses, jobs=jobs))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
+    assert result.error is None, result.error
+    return {
+        'peers': n_peers,
+        'peers_used': result.peers,
+        'jobs': jobs,
+        'blocks': result.blocks,
+        'transactions': result.transactions,
+        'seconds': result.seconds,
+        'blocks_per_sec': result.blocks_per_sec,
+        'transactions_per_sec': result.transactions_per_sec,
+    }
+
+
+# commands timed by bench_startup, {chain}, {wallet} and {address} are taken from the fixture
+STARTUP_COMMANDS = {
+    'help': ['--help'],
+    'wallet info': ['wallet', 'info', '--wallet', '{wallet}'],
+    'chain status': ['chain', 'status', '--chain', '{chain}'],
+    'chain info': ['chain', 'info', '--chain', '{chain}'],
+    'chain verify --headers-only': ['chain', 'verify', '--chain', '{chain}', '--headers-only'],
+    'address balance': ['address', 'balance', '--chain', '{chain}', '--address', '{address}'],
+    'address history': ['address', 'history', '--chain', '{chain}', '--address', '{address}'],
+}
+
+
+def bench_startup(f: Fixture, repeat: int = 3) -> Dict:
+    # wall time of a new `python -m bchain` process per command, as run from scripts. every
+    # command runs once untimed first, so that the files kept next to the chain (checkpoint,
+    # summary, index) are up to date like on repeated calls
+    cwd = Path(__file__).resolve().parent.parent
+    with tempfile.TemporaryDirectory() as tmp:
+        p_chain = Path(tmp) / 'chain.bch'
+        shutil.copy(f.p_store, p_chain)
+        fields = {
+            'chain': str(p_chain),
+            'wallet': str(f.p_wallet(0).resolve()),
+            'address': f.wallets[0].b64_address,
+        }
+
+        def timed(argv: List[str]) -> float:
+            return _best(lambda _: subprocess.run(argv, cwd=cwd, stdout=subprocess.DEVNULL, check=True), repeat)
+
+        commands = {}
+        for name, args in STARTUP_COMMANDS.items():
+            argv = [sys.executable, '-m', __package__] + [arg.format(**fields) for arg in args]
+            subprocess.run(argv, cwd=cwd, stdout=subprocess.DEVNULL, check=True)
+            commands[name] = timed(argv)
+        interpreter = timed([sys.executable, '-c', 'pass'])
+    return {
+        'interpreter_seconds': interpreter,  # the floor of every command
+        'seconds': commands,
+    }
+
+
+BENCHMARKS = ['mining', 'verify', 'load_save', 'balances', 'admission', 'memory', 'sync', 'startup']
+
+
+def run(
+        only: Optional[List[str]] = None,
+        n_wallets: int = 8,
+        n_blocks: int = 20,
+        n_transactions: int = 50,
+        jobs: int = 1,
+        repeat: int = 3,
+        hashes: int = 200000,
+        fixtures_dir: Path = FIXTURES_DIR,
+        n_peers: int = 3,
+) -> Dict:
+    only = only or BENCHMARKS
+    f = fixture(n_wallets, n_blocks, n_transactions, fixtures_dir)
+    res: Dict = {
+        'python': platform.python_version(),
+        'fixture': {
+            'name': f.path.name,
+            'wallets': n_wallets,
+            'blocks': n_blocks,
+            'transactions_per_block': n_transactions,
+        },
+    }
+    if 'mining' in only:
+        res['mining'] = bench_mining_loop(hashes)
+    if 'verify' in only:
+        res['verify'] = bench_verify(f, jobs, repeat)
+    if 'load_save' in only:
+        res['load_save'] = bench_load_save(f, repeat)
+    if 'balances' in only:
+        res['balances'] = bench_balances(f, repeat)
+    if 'admission' in only:
+        res['admission'] = bench_admission(f, jobs, repeat)
+    if 'memory' in only:
+        res['memory'] = bench_transaction_memory(n_blocks * n_transactions)
+    if 'sync' in only:
+        res['sync'] = bench_sync(f, n_peers, jobs)
+    if 'startup' in only:
+        res['startup'] = bench_startup(f, repeat)
+    return res
+
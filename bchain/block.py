@@ -1,74 +1,226 @@
 import base64
 import datetime
 import hashlib
-import random
+import threading
 from typing import Optional, List, Dict
 
 from .transaction import Transaction
-from .merkle import MerkleTree
+from .merkle import MerkleTree, LEGACY_VERSION
+from . import miner, profiling
 
 
 COMPLEXITY = 3
 
 
+def header_prefix(b64_prev_hash: str, b64_transactions_hash: str, timestamp: str, b64_miner: Optional[str]) -> str:
+    # everything the block hash covers except the nonce
+    s = b64_prev_hash
+    s += ' ' + b64_transactions_hash
+    s += ' ' + timestamp
+    s += ' ' + (b64_miner if b64_miner is not None else '-')
+    s += ' '
+    return s
+
+
+def is_proved_hash(b64_hash: str) -> bool:
+    return b64_hash[:COMPLEXITY] == '0' * COMPLEXITY
+
+
+class BlockHeader:
+    # the fields covered by the hash of a block, with its parent referenced by hash only,
+    # enough to check that blocks link up and satisfy the proof of work without their transactions
+    __slots__ = ('b64_prev_hash', 'b64_transactions_hash', 'timestamp', 'b64_miner', 'nonce', 'n_transactions', '_digest')
+
+    def __init__(
+            self,
+            b64_prev_hash: Optional[str],
+            b64_transactions_hash: str,
+            timestamp: Optional[str],
+            b64_miner: Optional[str],
+            nonce: Optional[int],
+            n_transactions: int = 0,
+    ) -> None:
+        self.b64_prev_hash = b64_prev_hash
+        self.b64_transactions_hash = b64_transactions_hash
+        self.timestamp = timestamp
+        self.b64_miner = b64_miner
+        self.nonce = nonce
+        self.n_transactions = n_transactions
+        self._digest: Optional[bytes] = None
+
+    @property
+    def b64_hash(self) -> str:
+        if self._digest is None:
+            s = header_prefix(self.b64_prev_hash if self.b64_prev_hash is not None else '-',
+                              self.b64_transactions_hash, self.timestamp, self.b64_miner)
+            s += str(self.nonce)
+            if profiling.ENABLED:
+                profiling.count('hashes.block')
+            self._digest = hashlib.sha256(s.encode()).digest()
+        return base64.b64encode(self._digest).decode()
+
+    @property
+    def is_mined(self) -> bool:
+        return self.b64_miner is not None
+
+    @property
+    def is_proved(self) -> bool:
+        return is_proved_hash(self.b64_hash)
+
+    def todict(self) -> Dict:
+        return {
+            'prev_hash': self.b64_prev_hash,
+            'transactions_hash': self.b64_transactions_hash,
+            'timestamp': self.timestamp,
+            'miner': self.b64_miner,
+            'nonce': self.nonce,
+            'n_transactions': self.n_transactions,
+        }
+
+    @staticmethod
+    def fromdict(d: Dict) -> 'BlockHeader':
+        return BlockHeader(
+            b64_prev_hash=d['prev_hash'],
+            b64_transactions_hash=d['transactions_hash'],
+            timestamp=d['timestamp'],
+            b64_miner=d['miner'],
+            nonce=d['nonce'],
+            n_transactions=d['n_transactions'],
+        )
+
+
 class Block:
+    __slots__ = ('_prev_block', '_b64_prev_hash', '_transactions', '_b64_miner', '_timestamp', '_nonce', '_digest')
+
     def __init__(
             self,
             b64_miner: Optional[str] = None,
             prev_block: Optional['Block'] = None,
             transactions: Optional[MerkleTree] = None,
             timestamp: str = None,
-            nonce: int = None
+            nonce: int = None,
+            b64_prev_hash: Optional[str] = None,
+            b64_hash: Optional[str] = None,
     ) -> None:
+        # the previous block is referenced either as an object or, for blocks
+        # loaded on their own, by its hash. a known b64_hash stands in for
+        # transactions that were pruned
         self._prev_block = prev_block
+        self._b64_prev_hash = b64_prev_hash
         self._transactions = transactions if transactions is not None else MerkleTree()
         self._b64_miner = b64_miner
         self._timestamp = timestamp
         self._nonce = nonce
+        # cached raw hash, see invalidate_hash
+        self._digest: Optional[bytes] = base64.b64decode(b64_hash) if b64_hash is not None else None
 
     def add_transaction(self, transaction: Transaction) -> None:
         self._transactions.add_transaction(transaction)
+        self.invalidate_hash()
+
+    def invalidate_hash(self) -> None:
+        # must be called whenever a field covered by the hash changes
+        self._digest = None
 
     @property
     def b64_miner(self) -> Optional[str]:
         return self._b64_miner
 
+    @property
+    def timestamp(self) -> Optional[str]:
+        return self._timestamp
+
+    @property
+    def nonce(self) -> Optional[int]:
+        return self._nonce
+
     @property
     def transactions(self) -> List[Transaction]:
         return self._transactions.transactions
 
+    @property
+    def merkle_tree(self) -> MerkleTree:
+        return self._transactions
+
+    @property
+    def header(self) -> BlockHeader:
+        return BlockHeader(self.b64_prev_hash, self._transactions.b64_hash, self._timestamp, self._b64_miner,
+                           self._nonce, len(self._transactions.nodes))
+
     @property
     def prev_block(self) -> Optional['Block']:
         return self._prev_block
 
+    @property
+    def b64_prev_hash(self) -> Optional[str]:
+        if self._prev_block is not None:
+            return self._prev_block.b64_hash
+        return self._b64_prev_hash
+
     @property
     def b64_hash(self) -> str:
-        s = ''
+        if self._digest is None:
+            # fill the cache oldest-first so that long chains are hashed
+            # iteratively, each block exactly once
+            pending = []
+            block = self
+            while block is not None and block._digest is None:
+                pending.append(block)
+                block = block._prev_block
+            for block in reversed(pending):
+                block._digest = block._compute_digest()
+        return base64.b64encode(self._digest).decode()
+
+    def _compute_digest(self) -> bytes:
         if self._prev_block is not None:
-            s += self._prev_block.b64_hash
+            s = self._header_prefix(base64.b64encode(self._prev_block._digest).decode())
         else:
-            s += '-'
+            s = self._header_prefix(self._b64_prev_hash if self._b64_prev_hash is not None else '-')
+        s += str(self._nonce)
 
-        s += ' ' + self._transactions.b64_hash
-        s += ' ' + self._timestamp
-        s += ' ' + (self._b64_miner if self._b64_miner is not None else '-')
-        s += ' ' + str(self._nonce)
+        if profiling.ENABLED:
+            profiling.count('hashes.block')
+        return hashlib.sha256(s.encode()).digest()
 
-        return base64.b64encode(hashlib.sha256(s.encode()).digest()).decode()
+    def _header_prefix(self, b64_prev_hash: str) -> str:
+        return header_prefix(b64_prev_hash, self._transactions.b64_hash, self._timestamp, self._b64_miner)
 
-    def mine(self, b64_miner: str) -> None:
+    def mine(
+            self,
+            b64_miner: str,
+            workers: int = 1,
+            batch_size: int = miner.DEFAULT_BATCH_SIZE,
+            cancel: Optional[threading.Event] = None,
+    ) -> Optional[miner.MiningResult]:
         assert not self.is_mined
-        self._nonce = 0
         self._timestamp = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
         self._b64_miner = b64_miner
-        while not self.is_proved:
-            self._nonce += random.randint(0x1, 0xFF)  # random step
+        b64_prev_hash = self.b64_prev_hash
+        prefix = self._header_prefix(b64_prev_hash if b64_prev_hash is not None else '-')
+        result = miner.mine(prefix, COMPLEXITY, workers=workers, batch_size=batch_size, cancel=cancel)
+        if result is None:  # cancelled, the block stays open
+            self._timestamp = None
+            self._b64_miner = None
+            return None
+        self._nonce = result.nonce
+        self.invalidate_hash()
+        if profiling.ENABLED:
+            profiling.count('hashes.mining', result.hashes)
+        return result
 
-    def verify(self) -> bool:
+    def snapshot(self) -> 'Block':
+        # open copy of this block with its current transactions, to be mined while this one keeps growing
+        assert not self.is_mined
+        tree = MerkleTree(version=self._transactions.version)
+        for transaction in self.transactions:
+            tree.add_transaction(transaction)
+        return Block(prev_block=self._prev_block, transactions=tree, b64_prev_hash=self._b64_prev_hash)
+
+    def verify(self, check_signatures: bool = True) -> bool:
         # assuming previous blocks are valid, check the validity of current block
         if self.is_mined and not self.is_proved:
             return False
-        if not self._transactions.verify():
+        if not self._transactions.verify(check_signatures):
             return False
         return True
 
@@ -78,23 +230,29 @@ class Block:
 
     @property
     def is_proved(self) -> bool:
-        return self.b64_hash[:COMPLEXITY] == '0' * COMPLEXITY
+        return is_proved_hash(self.b64_hash)
 
     def todict(self) -> Dict:
-        return {
+        d = {
             'hash': self.b64_hash if self.is_mined else None,
             'timestamp': self._timestamp if self.is_mined else None,
             'miner': self._b64_miner if self.is_mined else None,
             'nonce': self._nonce if self.is_mined else None,
             'transactions': self._transactions.tolist(),
         }
+        if self._transactions.version != LEGACY_VERSION:  # legacy blocks keep their original format
+            d['merkle_version'] = self._transactions.version
+        return d
 
     @staticmethod
-    def fromdict(d: Dict, prev_block: Optional['Block'] = None) -> 'Block':
+    def fromdict(d: Dict, prev_block: Optional['Block'] = None, b64_prev_hash: Optional[str] = None) -> 'Block':
+        if profiling.ENABLED:
+            profiling.count('blocks.parsed')
         return Block(
             b64_miner=d['miner'],
             timestamp=d['timestamp'],
-            transactions=MerkleTree.fromlist(d['transactions']),
+            transactions=MerkleTree.fromlist(d['transactions'], version=d.get('merkle_version', LEGACY_VERSION)),
             nonce=d['nonce'],
-            prev_block=prev_block
+            prev_block=prev_block,
+            b64_prev_hash=b64_prev_hash,
         )
@@ -1,8 +1,11 @@
 import json
 from pathlib import Path
-from typing import List, Dict, Set, Tuple
+from typing import Iterator, List, Dict, Optional, Set, Tuple
 
+from . import profiling, signatures
 from .block import Block
+from .ledger import Ledger
+from .merkle import MerkleTree
 from .transaction import Transaction
 
 
@@ -17,22 +20,55 @@ class Chain:
         assert len(blocks) > 0
 
         self.blocks = blocks
+        self.base: Optional[Ledger] = None  # state restored from a snapshot, see restore
+        self._ledger = Ledger(MINING_REWARD)
 
-    def verify(self) -> bool:
+    def verify(self, jobs: int = 1, start: int = 0) -> bool:
+        # blocks before `start` are trusted to be already verified
         assert len(self.blocks) > 0
-        if not self.blocks[0].verify() or not self.blocks[0].is_mined:
+        assert 0 <= start <= len(self.blocks)
+        # one pass holding only the previous block, so that lazily loaded chains are streamed
+        # and every block is decoded once: structure and proof of work are checked as blocks
+        # are read, their signatures in batches as they come
+        failed = False
+
+        def checked() -> Iterator[Block]:
+            nonlocal failed
+            prev_block = self.blocks[start - 1] if start > 0 else None
+            for i, block in enumerate(self.blocks[start:], start):
+                if prev_block is None:
+                    failed = not block.verify(check_signatures=False) or not block.is_mined
+                else:
+                    failed = block.b64_prev_hash != prev_block.b64_hash \
+                        or not block.verify(check_signatures=False) \
+                        or (i != len(self.blocks) - 1 and not block.is_mined)
+                if failed:
+                    return
+                yield block
+                prev_block = block
+
+        invalid = signatures.find_invalid(checked(), jobs=jobs)
+        if invalid is not None:
+            print(f'Invalid signature: block {start + invalid[0]}, transaction {invalid[1]}')
             return False
-        for i in range(1, len(self.blocks)):
-            prev_block = self.blocks[i - 1]
-            block = self.blocks[i]
-            if block.prev_block.b64_hash != prev_block.b64_hash:
-                return False
-            if not block.verify():
-                return False
-            if (i != len(self.blocks) - 1) and not block.is_mined:
-                return False
 
-        return True
+        return not failed
+
+    @property
+    def ledger(self) -> Ledger:
+        # apply blocks mined or appended since the last query
+        while self._ledger.height < len(self.blocks):
+            block = self.blocks[self._ledger.height]  # decoded once, see store.LazyBlocks
+            if not block.is_mined:
+                break
+            self._ledger.apply_block(block)
+        return self._ledger
+
+    def restore(self, ledger: Ledger) -> None:
+        # start balances from the state of a snapshot instead of the genesis block
+        assert ledger.height <= self.length and ledger.mining_reward == MINING_REWARD
+        self.base = ledger
+        self._ledger = ledger.copy()
 
     @property
     def last_block(self) -> Block:
@@ -42,9 +78,10 @@ class Chain:
     def length(self) -> int:
         return len(self.blocks)
 
-    def add_block(self, block: Block) -> None:
-        assert block.prev_block.b64_hash == self.last_block.b64_hash
-        assert block.verify()
+    def add_block(self, block: Block, check_signatures: bool = True) -> None:
+        # signatures may have been checked already, e.g. by bchain.sync while downloading
+        assert block.b64_prev_hash == self.last_block.b64_hash
+        assert block.verify(check_signatures)
         self.blocks.append(block)
 
     def add_transaction(self, transaction: Transaction) -> bool:
@@ -57,6 +94,23 @@ class Chain:
         self.last_block.add_transaction(transaction)
         return True
 
+    def seal(self, block: Block) -> None:
+        # replace the open last block by `block`, a mined snapshot of it. transactions
+        # added to the open block after the snapshot move to a new open block
+        open_block = self.last_block
+        assert not open_block.is_mined and block.is_mined
+        assert block.b64_prev_hash == open_block.b64_prev_hash
+        n = len(block.transactions)
+        assert n <= len(open_block.transactions)
+        assert all(a is b for a, b in zip(block.transactions, open_block.transactions[:n]))
+        self.blocks[-1] = block
+        leftovers = open_block.transactions[n:]
+        if leftovers:
+            next_block = Block(prev_block=block, transactions=MerkleTree(version=open_block.merkle_tree.version))
+            for transaction in leftovers:
+                next_block.add_transaction(transaction)
+            self.blocks.append(next_block)
+
     @staticmethod
     def new_chain(b64_miner: str) -> 'Chain':
         genesis_block = Block()
@@ -67,8 +121,11 @@ class Chain:
         return [block.todict() for block in self.blocks]
 
     def to_file(self, path: Path) -> None:
-        with open(path, 'w') as f:
-            json.dump(self.tolist(), f, indent=2)
+        l = self.tolist()
+        with profiling.phase('json.write'), open(path, 'w') as f:
+            json.dump(l, f, indent=2)
+            if profiling.ENABLED:
+                profiling.count('bytes.written', f.tell())
 
     @staticmethod
     def fromlist(l: List) -> 'Chain':
@@ -80,13 +137,17 @@ class Chain:
 
     @staticmethod
     def from_file(path: Path) -> 'Chain':
-        with open(path, 'r') as f:
-            return Chain.fromlist(json.load(f))
+        with profiling.phase('json.parse'), open(path, 'r') as f:
+            l = json.load(f)
+            if profiling.ENABLED:
+                profiling.count('bytes.read', f.tell())
+        return Chain.fromlist(l)
 
     @property
     def addresses(self) -> Set:
-        res = set()
-        for block in self.blocks:
+        res = self.ledger.addresses
+        # blocks past the mined prefix are not in the ledger
+        for block in self.blocks[self._ledger.height:]:
             if block.is_mined:
                 res.add(block.b64_miner)
             for transaction in block.transactions:
@@ -97,14 +158,11 @@ class Chain:
     def calculate_balance(self, b64_address: str, omit_unverified: bool = True) -> Tuple[int, int, int]:
         # return balances: current, min, max
         # calculate balance based on verified transactions
-        bal_cur = 0
-        bal_min = 0
-        bal_max = 0
-
-        for block in self.blocks:
-            if omit_unverified and not block.is_mined:  # unverified transactions
-                break
+        bal_cur, bal_min, bal_max = self.ledger.balance(b64_address)
+        if omit_unverified:  # the ledger stops at the first unverified block
+            return bal_cur, bal_min, bal_max
 
+        for block in self.blocks[self._ledger.height:]:
             # transactions first
             for transaction in block.transactions:
                 if transaction.b64_sender == b64_address:
@@ -117,13 +175,32 @@ class Chain:
             # mining happened after transactions
             if block.b64_miner == b64_address:
                 bal_cur += MINING_REWARD
-                if bal_min is None:
-                    bal_min = bal_cur
-                    bal_max = bal_cur
                 bal_min = min(bal_min, bal_cur)
                 bal_max = max(bal_max, bal_cur)
 
         return bal_cur, bal_min, bal_max
 
     def get_subchain(self, n: int) -> 'Chain':
-        return Chain(self.blocks[:n])
\ No newline at end of file
+        c = Chain(self.blocks[:n])
+        if self.base is not None and self.base.height <= n:
+            c.restore(self.base)
+        return c
+
+    def info(self, block_limit: int = -1, balances: bool = True, engine: str = 'python') -> Dict:
+        # summary reported by `chain info`, balances are over the first block_limit blocks.
+        # the numpy engine computes them on columns (see bchain.analytics)
+        res = {
+            'length': self.length,
+            'first_block': self.blocks[0].b64_hash,
+            'last_block_mined': self.last_block.is_mined,
+        }
+        if balances:
+            if engine == 'numpy':
+                from . import analytics  # numpy is optional
+                c = self.get_subchain(block_limit if block_limit > 0 else self.length)
+                c.restore(analytics.Columns.fromchain(c).ledger(c.length))
+            else:
+                c = self.get_subchain(block_limit) if block_limit > 0 else self
+            res['subchain_length'] = c.length
+            res['balances'] = {address: list(c.calculate_balance(address)) for address in c.addresses}
+        return res
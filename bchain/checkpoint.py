@@ -0,0 +1,60 @@
+import json
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from . import snapshot, store
+from .chain import Chain
+
+
+class Checkpoint(NamedTuple):
+    height: int  # number of leading blocks fully verified
+    b64_hash: str  # hash of the last of them
+
+
+def path_for(p_chain: Path) -> Path:
+    return p_chain.with_name(p_chain.name + '.checkpoint')
+
+
+def load(p_chain: Path) -> Optional[Checkpoint]:
+    try:
+        with open(path_for(p_chain), 'r') as f:
+            d = json.load(f)
+        return Checkpoint(int(d['height']), str(d['hash']))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save(p_chain: Path, checkpoint: Checkpoint) -> None:
+    with open(path_for(p_chain), 'w') as f:
+        json.dump({'height': checkpoint.height, 'hash': checkpoint.b64_hash}, f)
+
+
+def matches(c: Chain, checkpoint: Checkpoint) -> bool:
+    # the hash of a block covers all blocks before it (see store.hashes_match),
+    # so a matching hash means an unchanged prefix
+    if not 0 < checkpoint.height <= c.length:
+        return False
+    block = c.blocks[checkpoint.height - 1]
+    return block.is_mined and block.b64_hash == checkpoint.b64_hash and store.hashes_match(c, checkpoint.height)
+
+
+def verify(c: Chain, p_chain: Path, jobs: int = 1) -> bool:
+    # verify the chain stored at p_chain, skipping the prefix recorded by its checkpoint
+    # or covered by its snapshot, whose balances the chain then starts from
+    checkpoint = load(p_chain)
+    start = checkpoint.height if checkpoint is not None and matches(c, checkpoint) else 0
+    snapshot_height = snapshot.restore(c, p_chain)
+    if snapshot_height < store.pruned_height(c):
+        print('The chain is pruned and its snapshot is missing, invalid or not trusted')
+        return False
+    start = max(start, snapshot_height)
+    if not c.verify(jobs=jobs, start=start):
+        return False
+
+    # only mined blocks are final, the open block may still change
+    height = c.length if c.last_block.is_mined else c.length - 1
+    if height > 0:
+        verified = Checkpoint(height, c.blocks[height - 1].b64_hash)
+        if verified != checkpoint:
+            save(p_chain, verified)
+    return True
@@ -0,0 +1,51 @@
+import base64
+import binascii
+import calendar
+import datetime
+import time
+from typing import Optional, Union
+
+
+# Compact in-memory forms of the text fields of the chain. Values that would not
+# convert back to exactly the same text are kept as they are, so that
+# serialization and hashes never change.
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def b64_compact(s: Optional[str]) -> Union[bytes, str, None]:
+    if s is None:
+        return None
+    try:
+        raw = base64.b64decode(s.encode(), validate=True)
+    except (binascii.Error, UnicodeEncodeError):
+        return s
+    return raw if base64.b64encode(raw).decode() == s else s
+
+
+def b64_expand(v: Union[bytes, str, None]) -> Optional[str]:
+    if isinstance(v, bytes):
+        return base64.b64encode(v).decode()
+    return v
+
+
+def timestamp_now() -> int:
+    # local wall-clock time, stored as if it was UTC so that it formats back unchanged
+    return calendar.timegm(datetime.datetime.now().timetuple())
+
+
+def timestamp_compact(s: Union[str, int, None]) -> Union[int, str, None]:
+    # "YYYY-mm-dd HH:MM:SS" -> seconds since epoch
+    if not isinstance(s, str) or len(s) != 19:
+        return s
+    try:
+        t = calendar.timegm((int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19])))
+    except ValueError:
+        return s
+    return t if timestamp_expand(t) == s else s
+
+
+def timestamp_expand(v: Union[int, str, None]) -> Optional[str]:
+    if isinstance(v, int):
+        return time.strftime(TIMESTAMP_FORMAT, time.gmtime(v))
+    return v
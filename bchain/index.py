@@ -0,0 +1,193 @@
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from . import checkpoint, store
+from .chain import Chain
+from .summary import stamp_of
+
+
+# Secondary indexes of the mined blocks of a chain, kept in an SQLite file next to it.
+# They are extended block by block, and rebuilt when the indexed prefix of the chain
+# no longer matches (e.g. the chain file was replaced). The size and modification time
+# of the chain file at the last update are recorded, queries on an unchanged file do
+# not load the chain. A changed chain is verified before it is indexed.
+
+_VERSION = 3  # indexes of other versions are rebuilt
+_TABLES = ('meta', 'blocks', 'transactions', 'addresses')
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    hash TEXT PRIMARY KEY,
+    height INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_height ON blocks (height);
+CREATE TABLE IF NOT EXISTS transactions (
+    hash TEXT NOT NULL,
+    height INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    sender_pk TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    PRIMARY KEY (height, idx)
+);
+CREATE INDEX IF NOT EXISTS transactions_hash ON transactions (hash);
+CREATE TABLE IF NOT EXISTS addresses (
+    address TEXT NOT NULL,
+    height INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    PRIMARY KEY (address, height, idx)
+) WITHOUT ROWID;
+'''
+
+
+class Location(NamedTuple):
+    height: int
+    index: int
+
+
+class HistoryEntry(NamedTuple):
+    height: int
+    index: int
+    b64_hash: str
+    b64_sender: str
+    b64_receiver: str
+    amount: int
+    timestamp: str
+
+
+def path_for(p_chain: Path) -> Path:
+    return p_chain.with_name(p_chain.name + '.index')
+
+
+class Index:
+    def __init__(
+            self,
+            p_chain: Path,
+    ) -> None:
+        self.p_chain = p_chain
+        self._db = sqlite3.connect(path_for(p_chain))
+        self._db.executescript(_SCHEMA)
+        if self._meta('version') != _VERSION:
+            with self._db:
+                for table in _TABLES:
+                    self._db.execute(f'DROP TABLE {table}')
+            self._db.executescript(_SCHEMA)
+            with self._db:
+                self._db.execute('INSERT INTO meta VALUES (?, ?)', ('version', _VERSION))
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _meta(self, key: str) -> Optional[Union[int, str]]:
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    @property
+    def height(self) -> int:
+        # number of indexed blocks
+        return self._meta('height') or 0
+
+    def _clear(self) -> None:
+        for table in _TABLES:
+            self._db.execute(f'DELETE FROM {table}' + (" WHERE key != 'version'" if table == 'meta' else ''))
+
+    def update(self, c: Chain, stamp: Optional[Tuple[int, int]] = None) -> int:
+        # index the mined blocks added since the last update, return their number.
+        # stamp: of the chain file `c` was read from before reading it
+        height = self.height
+        if height > 0 and not (height <= c.length and c.blocks[height - 1].is_mined
+                               and c.blocks[height - 1].b64_hash == self._meta('hash')):
+            height = 0
+        with self._db:
+            if height == 0:
+                self._clear()
+            start = height
+            for block in c.blocks[start:]:
+                if not block.is_mined:
+                    break
+                self._db.execute('INSERT OR REPLACE INTO blocks VALUES (?, ?)', (block.b64_hash, height))
+                for i, transaction in enumerate(block.transactions):
+                    sender, receiver = transaction.b64_sender, transaction.b64_receiver
+                    self._db.execute(
+                        'INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (transaction.b64_hash, height, i, sender, receiver, transaction.amount, transaction.timestamp,
+                         transaction.str_sender_pk, transaction.b64_signature))
+                    self._db.executemany(
+                        'INSERT OR IGNORE INTO addresses VALUES (?, ?, ?)',
+                        [(sender, height, i), (receiver, height, i)])
+                height += 1
+            if height > start:
+                self._db.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+                    ('height', height),
+                    ('hash', c.blocks[height - 1].b64_hash),
+                ])
+            self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             ('stamp', _format_stamp(stamp) if stamp is not None else None))
+        return height - start
+
+    def refresh(self, jobs: int = 1) -> int:
+        # update from the chain file, only loaded and verified if it changed since the last
+        # update. raises ValueError if the chain is not valid
+        stamp = stamp_of(self.p_chain)
+        if self._meta('stamp') == _format_stamp(stamp):
+            return 0
+        c = store.load(self.p_chain)
+        if not checkpoint.verify(c, self.p_chain, jobs=jobs):
+            raise ValueError('The chain is not valid')
+        return self.update(c, stamp)
+
+    def history(self, b64_address: str) -> List[HistoryEntry]:
+        # transactions sending to or from the address, oldest first
+        return [HistoryEntry(*row) for row in self._db.execute(
+            'SELECT t.height, t.idx, t.hash, t.sender, t.receiver, t.amount, t.timestamp '
+            'FROM addresses a JOIN transactions t ON t.height = a.height AND t.idx = a.idx '
+            'WHERE a.address = ? ORDER BY a.height, a.idx',
+            (b64_address,),
+        )]
+
+    def find_transaction(self, b64_hash: str) -> List[Location]:
+        # the same signed transaction may have been added more than once
+        return [Location(*row) for row in self._db.execute(
+            'SELECT height, idx FROM transactions WHERE hash = ? ORDER BY height, idx', (b64_hash,))]
+
+    def transaction(self, location: Location) -> Dict:
+        # as Transaction.todict()
+        timestamp, sender, receiver, amount, sender_pk, signature = self._db.execute(
+            'SELECT timestamp, sender, receiver, amount, sender_pk, signature FROM transactions '
+            'WHERE height = ? AND idx = ?', location).fetchone()
+        return {
+            'timestamp': timestamp,
+            'sender': sender,
+            'receiver': receiver,
+            'amount': amount,
+            'sender_pk': sender_pk,
+            'signature': signature,
+        }
+
+    def block_hash(self, height: int) -> Optional[str]:
+        row = self._db.execute('SELECT hash FROM blocks WHERE height = ?', (height,)).fetchone()
+        return row[0] if row is not None else None
+
+    def block_height(self, b64_hash: str) -> Optional[int]:
+        row = self._db.execute('SELECT height FROM blocks WHERE hash = ?', (b64_hash,)).fetchone()
+        return row[0] if row is not None else None
+
+
+def _format_stamp(stamp: Tuple[int, int]) -> str:
+    return f'{stamp[0]} {stamp[1]}'
+
+
+def update(c: Chain, p_chain: Path) -> int:
+    # c was just saved to p_chain
+    ix = Index(p_chain)
+    try:
+        return ix.update(c, stamp_of(p_chain))
+    finally:
+        ix.close()
@@ -0,0 +1,87 @@
+import base64
+import collections
+import functools
+import threading
+from hashlib import sha256
+from typing import Dict, Optional, Tuple
+
+import rsa
+
+
+# Process-wide LRU caches around public keys. The same few senders sign most
+# transactions, so their key strings are parsed and hashed once instead of per use.
+# Results of signature checks are kept too, for the batches of bchain.signatures as
+# well as for single checks.
+
+MAX_KEYS = 4096
+MAX_SIGNATURES = 1 << 16
+
+
+@functools.lru_cache(maxsize=MAX_KEYS)
+def _parse(str_pk: str) -> Tuple[rsa.PublicKey, str]:
+    n, e = [int(i) for i in str_pk.split()]
+    return rsa.PublicKey(n, e), base64.b64encode(sha256(str_pk.encode('ascii')).digest()).decode()
+
+
+def public_key(str_pk: str) -> rsa.PublicKey:
+    return _parse(str_pk)[0]
+
+
+def address(str_pk: str) -> str:
+    # address owned by the key: base64 of the SHA-256 of its string form
+    return _parse(str_pk)[1]
+
+
+_signatures: Dict[Tuple[bytes, bytes, str], bool] = collections.OrderedDict()  # least recently used first
+_signature_stats = {'hits': 0, 'misses': 0}
+_signatures_lock = threading.Lock()
+
+
+def known(message: bytes, signature: bytes, str_pk: str) -> Optional[bool]:
+    # result of an earlier check of the signature, None if it was not checked
+    key = (message, signature, str_pk)
+    with _signatures_lock:
+        valid = _signatures.get(key)
+        if valid is None:
+            _signature_stats['misses'] += 1
+        else:
+            _signatures.move_to_end(key)
+            _signature_stats['hits'] += 1
+        return valid
+
+
+def remember(message: bytes, signature: bytes, str_pk: str, valid: bool) -> None:
+    key = (message, signature, str_pk)
+    with _signatures_lock:
+        _signatures[key] = valid
+        _signatures.move_to_end(key)
+        if len(_signatures) > MAX_SIGNATURES:
+            _signatures.popitem(last=False)
+
+
+def verify(message: bytes, signature: bytes, str_pk: str) -> bool:
+    # memo of signature checks, a transaction verified at admission is not verified again in its block
+    valid = known(message, signature, str_pk)
+    if valid is None:
+        try:
+            rsa.verify(message, signature, public_key(str_pk))
+            valid = True
+        except rsa.VerificationError:
+            valid = False
+        remember(message, signature, str_pk, valid)
+    return valid
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    info = _parse.cache_info()
+    return {
+        'keys': {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize},
+        'signatures': {**_signature_stats, 'size': len(_signatures), 'max_size': MAX_SIGNATURES},
+    }
+
+
+def clear() -> None:
+    _parse.cache_clear()
+    with _signatures_lock:
+        _signatures.clear()
+        _signature_stats.update(hits=0, misses=0)
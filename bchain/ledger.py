@@ -0,0 +1,75 @@
+from typing import Dict, List, Set, Tuple
+
+from . import profiling
+from .block import Block
+
+
+class Ledger:
+    # balances (current, min, max) of every address over a prefix of mined blocks,
+    # with the same semantics as the block-by-block scan of Chain.calculate_balance
+    def __init__(
+            self,
+            mining_reward: int,
+    ) -> None:
+        self.mining_reward = mining_reward
+        self.height = 0  # number of blocks applied
+        self._balances: Dict[str, List[int]] = {}
+
+    def _account(self, b64_address: str) -> List[int]:
+        account = self._balances.get(b64_address)
+        if account is None:
+            account = self._balances[b64_address] = [0, 0, 0]
+        return account
+
+    @staticmethod
+    def _update_bounds(account: List[int]) -> None:
+        account[1] = min(account[1], account[0])
+        account[2] = max(account[2], account[0])
+
+    def apply_block(self, block: Block) -> None:
+        assert block.is_mined
+        if profiling.ENABLED:
+            profiling.count('blocks.applied')
+
+        # transactions first
+        for transaction in block.transactions:
+            sender = self._account(transaction.b64_sender)
+            receiver = self._account(transaction.b64_receiver)
+            sender[0] -= transaction.amount
+            receiver[0] += transaction.amount
+            self._update_bounds(sender)
+            self._update_bounds(receiver)
+
+        # mining happened after transactions
+        account = self._account(block.b64_miner)
+        account[0] += self.mining_reward
+        self._update_bounds(account)
+
+        self.height += 1
+
+    def balance(self, b64_address: str) -> Tuple[int, int, int]:
+        account = self._balances.get(b64_address)
+        if account is None:
+            return 0, 0, 0
+        return account[0], account[1], account[2]
+
+    @property
+    def addresses(self) -> Set[str]:
+        return set(self._balances)
+
+    def copy(self) -> 'Ledger':
+        return Ledger.fromdict(self.todict())
+
+    def todict(self) -> Dict:
+        return {
+            'height': self.height,
+            'mining_reward': self.mining_reward,
+            'balances': {address: list(account) for address, account in self._balances.items()},
+        }
+
+    @staticmethod
+    def fromdict(d: Dict) -> 'Ledger':
+        ledger = Ledger(d['mining_reward'])
+        ledger.height = d['height']
+        ledger._balances = {address: [int(v) for v in account] for address, account in d['balances'].items()}
+        return ledger
@@ -0,0 +1,86 @@
+import json
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+from . import signatures
+from .chain import Chain
+from .transaction import Transaction
+
+
+MAX_AMOUNT = (1 << 64) - 1  # block stores keep amounts as unsigned 64-bit integers
+
+
+class Mempool:
+    # admits signed transactions in batches before they go to Chain.add_transaction.
+    # spending of transactions not yet mined is tracked per sender, so a sender can
+    # not overdraw through several pending transactions
+    def __init__(
+            self,
+            c: Chain,
+            jobs: int = 1,
+    ) -> None:
+        self.chain = c
+        self.jobs = jobs
+        self.pending: List[Transaction] = []
+        self._spent: Dict[str, int] = {}
+        if not c.last_block.is_mined:
+            for transaction in c.last_block.transactions:
+                self._spend(transaction)
+
+    def _spend(self, transaction: Transaction) -> None:
+        self._spent[transaction.b64_sender] = self._spent.get(transaction.b64_sender, 0) + transaction.amount
+
+    def available(self, b64_address: str) -> int:
+        # mined balance minus pending spending
+        return self.chain.calculate_balance(b64_address)[0] - self._spent.get(b64_address, 0)
+
+    def submit(self, transactions: List[Transaction]) -> List[Optional[str]]:
+        # admit a batch, return None for every accepted transaction and the reason for every rejected one
+        valid = signatures.verify_all(transactions, jobs=self.jobs)
+        res: List[Optional[str]] = []
+        for transaction, signature_valid in zip(transactions, valid):
+            if not transaction.is_signed_by_sender:
+                res.append('Not signed by the sender')
+            elif not signature_valid:
+                res.append('Invalid signature')
+            elif self.available(transaction.b64_sender) - transaction.amount < 0:
+                res.append('Not enough funds')
+            else:
+                self.pending.append(transaction)
+                self._spend(transaction)
+                res.append(None)
+        return res
+
+    def confirm(self, transactions: List[Transaction]) -> None:
+        # the transactions were mined, their spending is now in the ledger
+        for transaction in transactions:
+            self._spent[transaction.b64_sender] -= transaction.amount
+            if not self._spent[transaction.b64_sender]:
+                del self._spent[transaction.b64_sender]
+
+    def flush(self) -> int:
+        # move the admitted transactions to the open block, return their number
+        n = 0
+        for transaction in self.pending:
+            if self.chain.add_transaction(transaction):
+                n += 1
+        self.pending = []
+        return n
+
+
+def parse_transaction(d: Dict) -> Transaction:
+    # transaction received from outside, amounts must be integers a block store can hold
+    amount = d['amount']
+    if type(amount) is not int or not 0 < amount <= MAX_AMOUNT:
+        raise ValueError(f'Invalid amount {amount!r}')
+    return Transaction.fromdict(d)
+
+
+def read_jsonl(f: TextIO) -> Iterable[Tuple[int, Optional[Transaction], Optional[str]]]:
+    # parse one transaction per line: (line number, transaction, error)
+    for i, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield i, parse_transaction(json.loads(line)), None
+        except (ValueError, KeyError, TypeError, AssertionError) as e:
+            yield i, None, f'Malformed transaction: {e!r}'
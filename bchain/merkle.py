@@ -3,10 +3,13 @@ from typing import Optional, List, Dict
 import hashlib
 import base64
 
+from . import profiling
 from .transaction import Transaction
 
 
 class MerkleNode:
+    __slots__ = ('transaction', 'prev_node', '_digest')
+
     def __init__(
             self,
             transaction: Transaction,
@@ -14,73 +17,185 @@ class MerkleNode:
     ) -> None:
         self.transaction = transaction
         self.prev_node = prev_node
+        self._digest: Optional[bytes] = None  # cached raw hash
+
+    def invalidate_hash(self) -> None:
+        self._digest = None
 
     @property
     def b64_hash(self) -> str:
+        if self._digest is None:
+            # same as Block.b64_hash: iterate over uncached predecessors instead of recursing
+            pending = []
+            node = self
+            while node is not None and node._digest is None:
+                pending.append(node)
+                node = node.prev_node
+            for node in reversed(pending):
+                node._digest = node._compute_digest()
+        return base64.b64encode(self._digest).decode()
+
+    def _compute_digest(self) -> bytes:
         assert self.transaction.is_signed
 
         s = self.transaction.signable_str
         s += ' ' + self.transaction.b64_signature
-        s += ' ' + self.prev_node.b64_hash if self.prev_node is not None else '-'
+        s += ' ' + base64.b64encode(self.prev_node._digest).decode() if self.prev_node is not None else '-'
 
-        return base64.b64encode(hashlib.sha256(s.encode()).digest()).decode()
+        if profiling.ENABLED:
+            profiling.count('hashes.merkle')
+        return hashlib.sha256(s.encode()).digest()
 
     def todict(self) -> Dict:
         return {
             'hash': self.b64_hash,
-            'timestamp': self.transaction.timestamp,
-            'sender': self.transaction.b64_sender,
-            'receiver': self.transaction.b64_receiver,
-            'amount': self.transaction.amount,
-            'sender_pk': self.transaction.str_sender_pk,
-            'signature': self.transaction.b64_signature
+            **self.transaction.todict(),
         }
 
     @staticmethod
     def fromdict(d: Dict, prev_node: Optional['MerkleNode'] = None) -> 'MerkleNode':
-        transaction = Transaction(
-            b64_sender=d['sender'],
-            b64_receiver=d['receiver'],
-            amount=d['amount'],
-            b64_signature=d['signature'],
-            str_sender_pk=d['sender_pk'],
-            timestamp=d['timestamp'],
-        )
-        return MerkleNode(transaction, prev_node)
+        return MerkleNode(Transaction.fromdict(d), prev_node)
+
+
+# Version 1 is the original hash chain: every node hashes its predecessor and the
+# last node stands for the whole block. Version 2 is a binary Merkle tree over the
+# transactions (hashed as in RFC 6962), which allows O(log n) inclusion proofs.
+LEGACY_VERSION = 1
+TREE_VERSION = 2
+DEFAULT_VERSION = TREE_VERSION
+
+
+def leaf_hash(transaction: Transaction) -> bytes:
+    assert transaction.is_signed
+    if profiling.ENABLED:
+        profiling.count('hashes.merkle')
+    return hashlib.sha256(b'\x00' + f"{transaction.signable_str} {transaction.b64_signature}".encode()).digest()
+
+
+def _interior_hash(left: bytes, right: bytes) -> bytes:
+    if profiling.ENABLED:
+        profiling.count('hashes.merkle')
+    return hashlib.sha256(b'\x01' + left + right).digest()
+
+
+def _split(n: int) -> int:
+    # the largest power of two smaller than n
+    return 1 << ((n - 1).bit_length() - 1)
+
+
+def verify_proof(leaf: bytes, index: int, size: int, proof: List[bytes], root: bytes) -> bool:
+    # check that `leaf` is the index-th of `size` leaves of the tree with the given root
+    if not 0 <= index < size:
+        return False
+    fn, sn = index, size - 1
+    r = leaf
+    for p in proof:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = _interior_hash(p, r)
+            while not fn & 1 and fn != 0:
+                fn >>= 1
+                sn >>= 1
+        else:
+            r = _interior_hash(r, p)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r == root
 
 
 class MerkleTree:
     def __init__(
             self,
             nodes: Optional[List[MerkleNode]] = None,
+            version: int = DEFAULT_VERSION,
     ) -> None:
+        assert version in (LEGACY_VERSION, TREE_VERSION)
         self.nodes = nodes if nodes is not None else []
+        self.version = version
+        # version 2: hashes of the complete subtrees, _levels[k][i] covers leaves [i * 2^k, (i + 1) * 2^k).
+        # filled on demand, so appending a transaction costs O(log n) amortized hashing
+        self._levels: List[List[bytes]] = [[]]
 
     def add_transaction(self, transaction: Transaction) -> None:
-        node = MerkleNode(transaction, self.nodes[-1] if len(self.nodes) > 0 else None)
+        if self.version == LEGACY_VERSION:
+            node = MerkleNode(transaction, self.nodes[-1] if len(self.nodes) > 0 else None)
+        else:
+            node = MerkleNode(transaction)
         self.nodes.append(node)
 
     @property
     def transactions(self) -> List[Transaction]:
         return [n.transaction for n in self.nodes]
 
+    def _update_levels(self) -> List[List[bytes]]:
+        levels = self._levels
+        for node in self.nodes[len(levels[0]):]:
+            levels[0].append(leaf_hash(node.transaction))
+            k = 0
+            while len(levels[k]) % 2 == 0:
+                if len(levels) == k + 1:
+                    levels.append([])
+                levels[k + 1].append(_interior_hash(levels[k][-2], levels[k][-1]))
+                k += 1
+        return levels
+
+    def _subtree_hash(self, lo: int, hi: int) -> bytes:
+        n = hi - lo
+        if n & (n - 1) == 0:  # complete subtree, cached
+            k = n.bit_length() - 1
+            return self._levels[k][lo >> k]
+        k = _split(n)
+        return _interior_hash(self._subtree_hash(lo, lo + k), self._subtree_hash(lo + k, hi))
+
+    @property
+    def root(self) -> Optional[bytes]:
+        assert self.version == TREE_VERSION
+        if len(self.nodes) == 0:
+            return None
+        # fold the complete subtrees of the right edge, smallest first
+        res = None
+        for level in self._update_levels():
+            if len(level) % 2 == 1:
+                res = level[-1] if res is None else _interior_hash(level[-1], res)
+        return res
+
+    def proof(self, index: int) -> List[bytes]:
+        # hashes of the siblings on the path from leaf `index` to the root, bottom-up
+        assert self.version == TREE_VERSION, 'Inclusion proofs need a version 2 tree'
+        assert 0 <= index < len(self.nodes)
+        self._update_levels()
+        path = []
+        lo, hi = 0, len(self.nodes)
+        while hi - lo > 1:
+            k = _split(hi - lo)
+            if index < lo + k:
+                path.append(self._subtree_hash(lo + k, hi))
+                hi = lo + k
+            else:
+                path.append(self._subtree_hash(lo, lo + k))
+                lo = lo + k
+        return path[::-1]
+
     @property
     def b64_hash(self) -> str:
         if len(self.nodes) == 0:
             return base64.b64encode(b'-').decode()
+        if self.version == TREE_VERSION:
+            return base64.b64encode(self.root).decode()
         return base64.b64encode(self.nodes[-1].b64_hash.encode()).decode()
 
-    def verify(self) -> bool:
+    def verify(self, check_signatures: bool = True) -> bool:
         if len(self.nodes) == 0:
             return True
-        if not self.nodes[0].transaction.verify_signature():
+        if check_signatures and not self.nodes[0].transaction.verify_signature():
             return False
         for i in range(1, len(self.nodes)):
             prev_node = self.nodes[i - 1]
             node = self.nodes[i]
-            if node.prev_node.b64_hash != prev_node.b64_hash:  # test connectivity
+            if self.version == LEGACY_VERSION and node.prev_node.b64_hash != prev_node.b64_hash:  # test connectivity
                 return False
-            if not node.transaction.verify_signature():  # test signatures
+            if check_signatures and not node.transaction.verify_signature():  # test signatures
                 return False
         return True
 
@@ -88,10 +203,12 @@ class MerkleTree:
         return [n.todict() for n in self.nodes]
 
     @staticmethod
-    def fromlist(nodes: List) -> 'MerkleTree':
+    def fromlist(nodes: List, version: int = LEGACY_VERSION) -> 'MerkleTree':
         if len(nodes) == 0:
-            return MerkleTree()
+            return MerkleTree(version=version)
+        if version == TREE_VERSION:
+            return MerkleTree([MerkleNode.fromdict(node) for node in nodes], version=version)
         nodes_ = [MerkleNode.fromdict(nodes[0])]
         for node in nodes[1:]:
             nodes_.append(MerkleNode.fromdict(node, prev_node=nodes_[-1]))
-        return MerkleTree(nodes_)
+        return MerkleTree(nodes_, version=version)
@@ -0,0 +1,124 @@
+import hashlib
+import multiprocessing
+import queue
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+
+DEFAULT_BATCH_SIZE = 0x4000
+CANCEL_POLL_INTERVAL = .1  # seconds between checks of the cancel event while workers search
+
+
+class MiningResult(NamedTuple):
+    nonce: int
+    hashes: int
+    seconds: float
+
+    @property
+    def hashrate(self) -> float:
+        return self.hashes / self.seconds if self.seconds > 0 else 0.
+
+
+def _target(complexity: int) -> Tuple[bytes, int, int]:
+    # base64 '0' stands for the 6 bits 110100, so a hash proved with `complexity` zeros
+    # is a digest whose first 6 * complexity bits repeat that pattern.
+    # returns the whole leading bytes to match, plus the number and value of the remaining bits
+    n_bits = 6 * complexity
+    pattern = int('110100' * complexity, 2) if complexity > 0 else 0
+    n_full, n_rest = divmod(n_bits, 8)
+    head = (pattern >> n_rest).to_bytes(n_full, 'big')
+    tail = pattern & ((1 << n_rest) - 1)
+    return head, n_rest, tail
+
+
+def _search(prefix: bytes, complexity: int, start: int, stop: int) -> Optional[int]:
+    # scan nonces [start, stop) for a hash of prefix + nonce with enough leading zeros.
+    # the prefix is absorbed into the sha256 state once, every attempt only hashes the nonce
+    head, n_rest, tail = _target(complexity)
+    n_full = len(head)
+    shift = 8 - n_rest
+    midstate = hashlib.sha256(prefix)
+    for nonce in range(start, stop):
+        h = midstate.copy()
+        h.update(b'%d' % nonce)
+        digest = h.digest()
+        if digest[:n_full] == head and (n_rest == 0 or digest[n_full] >> shift == tail):
+            return nonce
+    return None
+
+
+def _worker(
+        prefix: bytes,
+        complexity: int,
+        worker_id: int,
+        workers: int,
+        batch_size: int,
+        stop,
+        hashes,
+        results,
+) -> None:
+    # worker k scans batches k, k + workers, k + 2 * workers, ...
+    batch = worker_id
+    while not stop.is_set():
+        start = batch * batch_size
+        nonce = _search(prefix, complexity, start, start + batch_size)
+        with hashes.get_lock():
+            hashes.value += batch_size if nonce is None else nonce - start + 1
+        if nonce is not None:
+            results.put(nonce)
+            return
+        batch += workers
+
+
+def mine(
+        prefix: str,
+        complexity: int,
+        workers: int = 1,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        cancel: Optional[threading.Event] = None,
+) -> Optional[MiningResult]:
+    # find a nonce such that sha256(prefix + str(nonce)) is proved,
+    # splitting the nonce space into batches shared among worker processes.
+    # returns None if `cancel` is set before a nonce is found
+    assert workers > 0 and batch_size > 0
+    started = time.perf_counter()
+    b_prefix = prefix.encode()
+
+    if workers == 1:
+        start = 0
+        while True:
+            nonce = _search(b_prefix, complexity, start, start + batch_size)
+            if nonce is not None:
+                return MiningResult(nonce, nonce + 1, time.perf_counter() - started)
+            start += batch_size
+            if cancel is not None and cancel.is_set():
+                return None
+
+    ctx = multiprocessing.get_context()
+    stop = ctx.Event()
+    hashes = ctx.Value('Q', 0)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(
+            target=_worker,
+            args=(b_prefix, complexity, i, workers, batch_size, stop, hashes, results),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        while True:
+            try:
+                nonce = results.get(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except queue.Empty:
+                if cancel is not None and cancel.is_set():
+                    return None
+    finally:
+        stop.set()
+        for p in processes:
+            p.join()
+    return MiningResult(nonce, hashes.value, time.perf_counter() - started)
@@ -0,0 +1,300 @@
+import asyncio
+import functools
+import json
+import socket
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import checkpoint, index, miner, store
+from .background import BackgroundMiner
+from .block import Block
+from .chain import Chain
+from .mempool import Mempool, parse_transaction
+
+
+# A node keeps a verified chain in memory and serves requests over a local TCP socket.
+# The protocol is one JSON object per line in both directions:
+#   request   {"id": 1, "method": "balance", "params": {"address": "..."}}
+#   response  {"id": 1, "result": [100, 0, 100]}  or  {"id": 1, "error": "..."}
+# Responses come in the order of the requests, clients may send several before reading
+# them (see bchain.sync). Heights in `locate`, `headers` and `blocks` are of mined blocks.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_HEADERS = 2048  # per `headers` request
+MAX_BLOCKS = 64  # per `blocks` request
+
+
+class NodeError(Exception):
+    pass
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host or DEFAULT_HOST, int(port) if port else DEFAULT_PORT
+
+
+def _positive(name: str, value: Any) -> int:
+    # RPC parameters come from clients, checked before they reach asserts deeper down
+    if type(value) is not int or value <= 0:
+        raise NodeError(f'{name} must be a positive integer')
+    return value
+
+
+################################################################################
+#  Server
+################################################################################
+
+class Node:
+    def __init__(
+            self,
+            c: Chain,
+            p_chain: Path,
+            jobs: int = 1,
+    ) -> None:
+        self.chain = c
+        self.p_chain = p_chain
+        self.jobs = jobs
+        self.mempool = Mempool(c, jobs=jobs)
+        self.lock = threading.Lock()  # guards the chain and its file, shared with the background miner
+        self.background: Optional[BackgroundMiner] = None
+        self._mine_lock = asyncio.Lock()  # one `mine` request at a time
+
+    @staticmethod
+    def load(p_chain: Path, jobs: int = 1) -> 'Node':
+        c = store.load(p_chain)
+        if not checkpoint.verify(c, p_chain, jobs=jobs):
+            raise NodeError('Invalid chain')
+        return Node(c, p_chain, jobs=jobs)
+
+    def _sealed(self, block: Block) -> None:
+        # called holding self.lock once a snapshot of the open block is mined
+        self.mempool.confirm(block.transactions)
+        store.save(self.chain, self.p_chain)
+        index.update(self.chain, self.p_chain)
+
+    def start_miner(
+            self,
+            b64_miner: str,
+            workers: int = 1,
+            batch_size: int = miner.DEFAULT_BATCH_SIZE,
+            on_sealed: Optional[Callable[[Block], None]] = None,
+    ) -> BackgroundMiner:
+        def sealed(block: Block) -> None:
+            self._sealed(block)
+            if on_sealed is not None:
+                on_sealed(block)
+
+        self.background = BackgroundMiner(
+            self.chain, self.lock, b64_miner, workers=workers, batch_size=batch_size, on_sealed=sealed)
+        self.background.start()
+        return self.background
+
+    # RPC methods
+
+    def info(self, block_limit: int = -1) -> Dict:
+        with self.lock:
+            return {'valid': True, **self.chain.info(block_limit)}
+
+    def balance(self, address: str) -> List[int]:
+        with self.lock:
+            return list(self.chain.calculate_balance(address))
+
+    def block(self, height: int) -> Dict:
+        with self.lock:
+            if not -self.chain.length <= height < self.chain.length:
+                raise NodeError('No such block')
+            return self.chain.blocks[height].todict()
+
+    def _mined_length(self) -> int:
+        c = self.chain
+        return c.length if c.last_block.is_mined else c.length - 1
+
+    def locate(self, locator: List[List]) -> Dict:
+        # the first (height, hash) pair of the locator that is on this chain, -1 if none
+        with self.lock:
+            length = self._mined_length()
+            common = -1
+            for height, b64_hash in locator:
+                if 0 <= height < length and store.header(self.chain, height).b64_hash == b64_hash:
+                    common = height
+                    break
+            return {'length': length, 'common': common}
+
+    def headers(self, start: int, count: int) -> List[Dict]:
+        with self.lock:
+            stop = min(start + min(count, MAX_HEADERS), self._mined_length())
+            return [store.header(self.chain, height).todict() for height in range(max(start, 0), stop)]
+
+    def blocks(self, start: int, count: int) -> List[Dict]:
+        with self.lock:
+            if start < store.pruned_height(self.chain):
+                raise NodeError(f'Blocks below height {store.pruned_height(self.chain)} are pruned')
+            stop = min(start + min(count, MAX_BLOCKS), self._mined_length())
+            return [self.chain.blocks[height].todict() for height in range(start, stop)]
+
+    def submit(self, transactions: List[Dict]) -> List[Optional[str]]:
+        try:
+            parsed = [parse_transaction(d) for d in transactions]
+        except (KeyError, TypeError, ValueError, AssertionError) as e:
+            raise NodeError(f'Malformed transaction: {e!r}')
+        with self.lock:
+            res = self.mempool.submit(parsed)
+            if self.mempool.pending:
+                self.mempool.flush()
+                store.save(self.chain, self.p_chain)
+        if self.background is not None:
+            self.background.notify()
+        return res
+
+    async def mine(self, miner_address: str, workers: int = 1, batch_size: int = miner.DEFAULT_BATCH_SIZE) -> Dict:
+        # mines a snapshot of the open block, so that transactions are still accepted meanwhile
+        if self.background is not None:
+            raise NodeError('Background miner is running')
+        _positive('workers', workers)
+        _positive('batch_size', batch_size)
+        if not isinstance(miner_address, str):
+            raise NodeError('miner_address must be a string')
+        async with self._mine_lock:
+            with self.lock:
+                if self.chain.last_block.is_mined:
+                    raise NodeError('Last block already mined!')
+                block = self.chain.last_block.snapshot()
+            result = await asyncio.to_thread(block.mine, miner_address, workers=workers, batch_size=batch_size)
+            await asyncio.to_thread(self._seal, block)
+            return {
+                'hash': block.b64_hash,
+                'hashes': result.hashes,
+                'seconds': result.seconds,
+                'hashrate': result.hashrate,
+            }
+
+    def _seal(self, block: Block) -> None:
+        with self.lock:
+            self.chain.seal(block)
+            self._sealed(block)
+
+    def miner_stats(self) -> Dict:
+        if self.background is None:
+            raise NodeError('No background miner')
+        return self.background.stats
+
+    _methods = {
+        'info': info,
+        'balance': balance,
+        'block': block,
+        'submit': submit,
+        'mine': mine,
+        'miner_stats': miner_stats,
+        'locate': locate,
+        'headers': headers,
+        'blocks': blocks,
+    }
+
+    async def _dispatch(self, request: Dict) -> Any:
+        method = self._methods.get(request.get('method'))
+        if method is None:
+            raise NodeError(f'Unknown method {request.get("method")!r}')
+        params = request.get('params', {})
+        if asyncio.iscoroutinefunction(method):
+            return await method(self, **params)
+        # in a thread: the methods wait for the lock, and may check signatures or save the
+        # chain, which would hold up every other client on the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(method, self, **params))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                response: Dict[str, Any] = {}
+                try:
+                    request = json.loads(line)
+                    response['id'] = request.get('id')
+                    response['result'] = await self._dispatch(request)
+                except (NodeError, ValueError, TypeError, AttributeError) as e:
+                    response['error'] = str(e)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+################################################################################
+#  Clients
+################################################################################
+
+class NodeClient:
+    def __init__(
+            self,
+            address: str,
+    ) -> None:
+        self._sock = socket.create_connection(parse_address(address))
+        self._file = self._sock.makefile('rwb')
+        self._id = 0
+
+    def call(self, method: str, **params) -> Any:
+        self._id += 1
+        self._file.write(json.dumps({'id': self._id, 'method': method, 'params': params}).encode() + b'\n')
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise NodeError('Connection closed by node')
+        response = json.loads(line)
+        if 'error' in response:
+            raise NodeError(response['error'])
+        return response['result']
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+
+async def _load_client(address: str, requests: int, method: str, params: Dict, latencies: List[float]) -> int:
+    reader, writer = await asyncio.open_connection(*parse_address(address))
+    errors = 0
+    try:
+        for i in range(requests):
+            started = time.perf_counter()
+            writer.write(json.dumps({'id': i, 'method': method, 'params': params}).encode() + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - started)
+            errors += 'error' in response
+    finally:
+        writer.close()
+    return errors
+
+
+async def load(address: str, clients: int, requests: int, method: str, params: Optional[Dict] = None) -> Dict:
+    # `clients` concurrent connections, each sending `requests` requests one after another
+    latencies: List[float] = []
+    started = time.perf_counter()
+    errors = await asyncio.gather(*[
+        _load_client(address, requests, method, params or {}, latencies) for _ in range(clients)
+    ])
+    seconds = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'method': method,
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'seconds': seconds,
+        'requests_per_sec': len(latencies) / seconds,
+        'latency_ms': {
+            'mean': statistics.mean(latencies) * 1000,
+            'p50': latencies[len(latencies) // 2] * 1000,
+            'p95': latencies[int(len(latencies) * .95)] * 1000,
+            'p99': latencies[int(len(latencies) * .99)] * 1000,
+            'max': latencies[-1] * 1000,
+        },
+    }
@@ -1,5 +1,49 @@
+import base64
+import csv
+import hashlib
+import importlib.util
+import json
+import sys
+import time
 from pathlib import Path
-from . import wallet, chain, transaction
+from types import ModuleType
+from typing import Dict, Iterable, List, Optional, TextIO, Tuple
+
+
+def _lazy(name: str) -> ModuleType:
+    # module executed on its first attribute access: a command only loads the modules it uses
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.find_spec(name)
+        spec.loader = importlib.util.LazyLoader(spec.loader)
+        module = sys.modules[name] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+
+asyncio = _lazy('asyncio')
+bench = _lazy(f'{__package__}.bench')
+block = _lazy(f'{__package__}.block')
+chain = _lazy(f'{__package__}.chain')
+checkpoint = _lazy(f'{__package__}.checkpoint')
+index = _lazy(f'{__package__}.index')
+mempool = _lazy(f'{__package__}.mempool')
+merkle = _lazy(f'{__package__}.merkle')
+miner = _lazy(f'{__package__}.miner')
+node = _lazy(f'{__package__}.node')
+signatures = _lazy(f'{__package__}.signatures')
+snapshot = _lazy(f'{__package__}.snapshot')
+store = _lazy(f'{__package__}.store')
+stream = _lazy(f'{__package__}.stream')
+summary = _lazy(f'{__package__}.summary')
+sync = _lazy(f'{__package__}.sync')
+transaction = _lazy(f'{__package__}.transaction')
+wallet = _lazy(f'{__package__}.wallet')
+
+
+def trust_signers(b64_addresses: List[str]) -> None:
+    # snapshots are only used when signed by one of these wallets
+    snapshot.trust(b64_addresses)
 
 
 ################################################################################
@@ -17,6 +61,30 @@ def wallet_create(
     w.to_file(path)
 
 
+def wallet_create_batch(
+        dest: Path,
+        count: int,
+        jobs: int = 1,
+        keystore: bool = False,
+        force: bool = False,
+) -> None:
+    if not force and wallet.batch_exists(dest):
+        print(f'{dest} or its index already exists, use --force to overwrite the keys. Abort')
+        return
+    print(f'Creating {count} wallets with {jobs} process(es)...')
+    started = time.perf_counter()
+    wallets = wallet.generate_batch(count, jobs=jobs)
+    seconds = time.perf_counter() - started
+    print(f'Created in {seconds:.2f}s ({count / seconds if seconds > 0 else 0:.1f} wallets/sec)')
+    print('Saving...')
+    try:
+        wallet.save_batch(wallets, dest, keystore=keystore, force=force)
+    except FileExistsError as e:
+        print(e, 'Abort')
+        return
+    print('Address index saved to', wallet.index_path(dest))
+
+
 def wallet_info(
         p_wallet: Path,
 ) -> None:
@@ -31,38 +99,56 @@ def wallet_info(
 def chain_create(
         dest: Path,
         p_wallet: Path,
+        binary: bool = False,
 ) -> None:
     print('Loading wallet...')
     w = wallet.Wallet.from_file(p_wallet)
     print('Creating chain...')
     c = chain.Chain.new_chain(w.b64_address)
-    c.to_file(dest)
+    if binary:
+        store.BlockStore.create(dest, c)
+    else:
+        c.to_file(dest)
     print('Done!')
 
 
-def chain_info(
+def chain_export(
         p_chain: Path,
-        block_limit: int = -1,
+        dest: Path,
+) -> None:
+    print('Loading chain...')
+    c = store.load(p_chain)
+    if store.pruned_height(c) > 0:
+        print(f'Blocks below height {store.pruned_height(c)} are pruned. Abort')
+        return
+    print('Exporting to JSON...')
+    c.to_file(dest)
+    print('Done!')
+
+
+def chain_import(
+        p_json: Path,
+        dest: Path,
 ) -> None:
-    c = chain.Chain.from_file(p_chain)
-    c_verified = c.verify()
-    print('Chain length:', c.length)
-    print('First block:', c.blocks[0].b64_hash)
-    print('Last block mined:', c.last_block.is_mined)
-    print('Chain valid:', c_verified)
-    if not c_verified:
+    print('Loading chain...')
+    c = chain.Chain.from_file(p_json)
+    print('Writing block store...')
+    store.BlockStore.create(dest, c)
+    print('Done!')
+
+
+def _print_chain_info(info: Dict) -> None:
+    print('Chain length:', info['length'])
+    print('First block:', info['first_block'])
+    print('Last block mined:', info['last_block_mined'])
+    print('Chain valid:', info['valid'])
+    if not info['valid']:
         print('Abort. Not valid')
         return
 
-    # calculate stats over balances
-    if block_limit > 0:
-        c_limited = c.get_subchain(block_limit)
-    else:
-        c_limited = c
-    addresses = c_limited.addresses
-    print('\nStatistics over addresses. Length of subchain:', c_limited.length)
-    for address in addresses:
-        b, b_min, b_max = c_limited.calculate_balance(address)
+    # stats over balances
+    print('\nStatistics over addresses. Length of subchain:', info['subchain_length'])
+    for address, (b, b_min, b_max) in info['balances'].items():
         if b == 0:
             continue
         print('\tBalance:', address)
@@ -71,12 +157,103 @@ def chain_info(
         print('\t\tMax:', b_max)
 
 
+def chain_info(
+        p_chain: Path,
+        block_limit: int = -1,
+        jobs: int = 1,
+        node_address: Optional[str] = None,
+        engine: str = 'python',
+) -> None:
+    if node_address is not None:
+        try:
+            client = node.NodeClient(node_address)
+            info = client.call('info', block_limit=block_limit)
+            client.close()
+        except (OSError, node.NodeError) as e:
+            print('Node error:', e)
+            return
+    elif block_limit <= 0 and engine == 'python':
+        # answered from the summary next to the chain while the chain file is unchanged
+        info = summary.current(p_chain, jobs=jobs).info()
+    else:
+        c = store.load(p_chain)
+        if 0 < block_limit < store.pruned_height(c):
+            print(f'Blocks below height {store.pruned_height(c)} are pruned, balances start from there. Abort')
+            return
+        c_verified = checkpoint.verify(c, p_chain, jobs=jobs)
+        try:
+            info = {'valid': c_verified, **c.info(block_limit, balances=c_verified, engine=engine)}
+        except ImportError as e:
+            print(e)
+            return
+    _print_chain_info(info)
+
+
+def chain_status(
+        p_chain: Path,
+        jobs: int = 1,
+) -> None:
+    s = summary.current(p_chain, jobs=jobs)
+    print('Chain length:', s.length)
+    print('Mined blocks:', s.height)
+    print('Tip hash:', s.b64_tip_hash)
+    print('Chain valid:', s.valid)
+
+
+def chain_verify(
+        p_chain: Path,
+        jobs: int = 1,
+        progress: bool = False,
+        headers_only: bool = False,
+) -> None:
+    def report(p: stream.Progress) -> None:
+        print(f'\tHeight {p.height}: {p.blocks_per_sec:.0f} blocks/sec, '
+              f'{p.transactions_per_sec:.0f} transactions/sec')
+
+    print('Verifying block headers...' if headers_only else 'Verifying chain...')
+    try:
+        result = stream.verify(p_chain, jobs=jobs, on_progress=report if progress else None, headers_only=headers_only)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print('Cannot read chain:', e)
+        return
+    p = result.progress
+    if not result.valid:
+        print(f'Invalid block at height {p.height}: {result.error}')
+    print('Headers valid:' if headers_only else 'Chain valid:', result.valid)
+    print(f'{p.height} blocks, {p.transactions} transactions in {p.seconds:.2f}s '
+          f'({p.blocks_per_sec:.0f} blocks/sec, {p.transactions_per_sec:.0f} transactions/sec)')
+    if result.checkpoint is not None and result.checkpoint != checkpoint.load(p_chain):
+        checkpoint.save(p_chain, result.checkpoint)
+
+
 def chain_mine(
         p_chain: Path,
         p_wallet: Path,
+        workers: int = 1,
+        batch_size: Optional[int] = None,
+        jobs: int = 1,
+        node_address: Optional[str] = None,
 ) -> None:
-    c = chain.Chain.from_file(p_chain)
-    if not c.verify():
+    if batch_size is None:
+        batch_size = miner.DEFAULT_BATCH_SIZE
+    if node_address is not None:
+        print('Loading wallet...')
+        w = wallet.Wallet.from_file(p_wallet)
+        print(f'Mining on node {node_address} with {workers} worker(s)...')
+        try:
+            client = node.NodeClient(node_address)
+            result = client.call('mine', miner_address=w.b64_address, workers=workers, batch_size=batch_size)
+            client.close()
+        except (OSError, node.NodeError) as e:
+            print('Node error:', e)
+            return
+        print(f"Mining succeeded! {result['hashes']} hashes in {result['seconds']:.2f}s "
+              f"({result['hashrate']:.0f} hashes/sec)")
+        print('Done!')
+        return
+
+    c = store.load(p_chain)
+    if not checkpoint.verify(c, p_chain, jobs=jobs):
         print('Chain invalid!')
         return
     if c.last_block.is_mined:
@@ -84,13 +261,174 @@ def chain_mine(
         return
     print('Loading wallet...')
     w = wallet.Wallet.from_file(p_wallet)
-    print('Mining...')
-    c.last_block.mine(w.b64_address)
-    print('Mining succeeded! Saving the chain...')
-    c.to_file(p_chain)
+    print(f'Mining with {workers} worker(s)...')
+    result = c.last_block.mine(w.b64_address, workers=workers, batch_size=batch_size)
+    print(f'Mining succeeded! {result.hashes} hashes in {result.seconds:.2f}s ({result.hashrate:.0f} hashes/sec)')
+    print('Saving the chain...')
+    store.save(c, p_chain)
+    index.update(c, p_chain)
+    print('Done!')
+
+
+def chain_snapshot(
+        p_chain: Path,
+        p_wallet: Path,
+        height: Optional[int] = None,
+        prune: bool = False,
+        jobs: int = 1,
+) -> None:
+    c = store.load(p_chain)
+    if not checkpoint.verify(c, p_chain, jobs=jobs):
+        print('Chain invalid!')
+        return
+    if height is None:
+        height = c.length if c.last_block.is_mined else c.length - 1
+    if not 0 < height <= c.length or not c.blocks[height - 1].is_mined:
+        print(f'No mined block at height {height - 1}!')
+        return
+    if height < store.pruned_height(c):
+        print(f'Blocks below height {store.pruned_height(c)} are pruned!')
+        return
+    print('Loading wallet...')
+    w = wallet.Wallet.from_file(p_wallet)
+    print(f'Signing the balances after {height} blocks...')
+    s = snapshot.create(c, height, w)
+    snapshot.save(p_chain, s)
+    print('Snapshot saved to', snapshot.path_for(p_chain))
+    print('Signed by:', s.b64_signer)
+    if s.b64_signer not in snapshot.trusted_signers:
+        print(f'Pass --trusted-signer {s.b64_signer} to use it')
+    if prune:
+        if not store.BlockStore.is_store(p_chain):
+            print('Only block stores can be pruned, see `chain import`')
+            return
+        print(f'Pruning the transactions of the blocks below height {height}...')
+        size = p_chain.stat().st_size
+        store.BlockStore.prune(p_chain, c, height).close()
+        print(f'{size} -> {p_chain.stat().st_size} bytes')
     print('Done!')
 
 
+def chain_sync(
+        p_chain: Path,
+        peers: List[str],
+        jobs: int = 1,
+        batch_size: Optional[int] = None,
+        depth: Optional[int] = None,
+        progress: bool = False,
+) -> None:
+    if batch_size is None:
+        batch_size = sync.DEFAULT_BATCH_SIZE
+    if depth is None:
+        depth = sync.DEFAULT_DEPTH
+    if batch_size > node.MAX_BLOCKS:
+        print(f'Nodes send at most {node.MAX_BLOCKS} blocks per request. Abort')
+        return
+    print('Loading and verifying chain...')
+    c = store.load(p_chain)
+    if not checkpoint.verify(c, p_chain, jobs=jobs):
+        print('Invalid chain! Abort')
+        return
+    if not c.last_block.is_mined:
+        if c.last_block.transactions:
+            print('Last block has transactions, mine it first. Abort')
+            return
+        c.blocks = c.blocks[:-1]
+    last_report = time.perf_counter()
+
+    def report(height: int) -> None:
+        nonlocal last_report
+        if time.perf_counter() - last_report >= 1.:
+            last_report = time.perf_counter()
+            print(f'\tHeight {height}')
+
+    print(f'Syncing from {len(peers)} peer(s)...')
+    try:
+        result = asyncio.run(sync.sync(c, peers, jobs=jobs, batch_size=batch_size, depth=depth,
+                                       on_progress=report if progress else None))
+    except sync.SyncError as e:
+        print(e, 'Abort')
+        return
+    if result.error is not None:
+        print(result.error)
+    print(f'{result.blocks} block(s), {result.transactions} transaction(s) from {result.peers} peer(s) '
+          f'in {result.seconds:.2f}s ({result.blocks_per_sec:.1f} blocks/sec, '
+          f'{result.transactions_per_sec:.0f} transactions/sec)')
+    if result.blocks == 0:
+        print('Nothing to add')
+        return
+    print('Saving the chain...')
+    store.save(c, p_chain)
+    index.update(c, p_chain)
+    checkpoint.save(p_chain, checkpoint.Checkpoint(c.length, c.last_block.b64_hash))
+    print('Done!')
+
+
+################################################################################
+#  Node Operations
+################################################################################
+
+def node_serve(
+        p_chain: Path,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        jobs: int = 1,
+        p_wallet: Optional[Path] = None,
+        workers: int = 1,
+        batch_size: Optional[int] = None,
+) -> None:
+    if host is None:
+        host = node.DEFAULT_HOST
+    if port is None:
+        port = node.DEFAULT_PORT
+    if batch_size is None:
+        batch_size = miner.DEFAULT_BATCH_SIZE
+    print('Loading and verifying chain...')
+    try:
+        n = node.Node.load(p_chain, jobs=jobs)
+    except node.NodeError as e:
+        print(e, 'Abort')
+        return
+    if p_wallet is not None:
+        print('Loading wallet...')
+        w = wallet.Wallet.from_file(p_wallet)
+
+        def sealed(b: block.Block) -> None:
+            stats = n.background.stats
+            print(f"Sealed block {b.b64_hash} with {len(b.transactions)} transaction(s): {stats['blocks_per_min']:.2f} blocks/min, "
+                  f"{stats['transactions_per_sec']:.2f} transactions/sec")
+
+        print(f'Mining in the background with {workers} worker(s)')
+        n.start_miner(w.b64_address, workers=workers, batch_size=batch_size, on_sealed=sealed)
+    print(f'Serving {p_chain} on {host}:{port}')
+    try:
+        asyncio.run(n.serve(host, port))
+    except KeyboardInterrupt:
+        print('Stopped')
+    if n.background is not None:
+        n.background.stop()
+        print(json.dumps(n.background.stats, indent=2))
+
+
+def node_bench(
+        node_address: Optional[str] = None,
+        clients: int = 8,
+        requests: int = 100,
+        method: str = 'info',
+        address: Optional[str] = None,
+        height: int = 0,
+) -> None:
+    if node_address is None:
+        node_address = f'{node.DEFAULT_HOST}:{node.DEFAULT_PORT}'
+    params = {'info': {}, 'balance': {'address': address}, 'block': {'height': height}}[method]
+    try:
+        result = asyncio.run(node.load(node_address, clients, requests, method, params))
+    except OSError as e:
+        print('Node error:', e)
+        return
+    print(json.dumps(result, indent=2))
+
+
 ################################################################################
 #  Transaction Operations
 ################################################################################
@@ -100,14 +438,18 @@ def transaction_create(
         p_chain: Path,
         receiver: str,
         amount: int,
+        jobs: int = 1,
+        dest: Optional[Path] = None,
+        node_address: Optional[str] = None,
 ) -> None:
     print('Loading wallet...')
     w = wallet.Wallet.from_file(p_wallet)
-    print('Loading and verifying chain...')
-    c = chain.Chain.from_file(p_chain)
-    if not c.verify():
-        print('Invalid chain! Abort')
-        return
+    if dest is None and node_address is None:
+        print('Loading and verifying chain...')
+        c = store.load(p_chain)
+        if not checkpoint.verify(c, p_chain, jobs=jobs):
+            print('Invalid chain! Abort')
+            return
 
     print('Creating new transaction...')
     t = transaction.Transaction(
@@ -117,9 +459,369 @@ def transaction_create(
     )
     print('Signing transaction...')
     t.sign(w)
+    if dest is not None:  # for submit-batch
+        print('Appending transaction to', dest)
+        with open(dest, 'a') as f:
+            f.write(json.dumps(t.todict()) + '\n')
+        print('Done!')
+        return
+    if node_address is not None:
+        print(f'Submitting transaction to node {node_address}...')
+        try:
+            client = node.NodeClient(node_address)
+            error, = client.call('submit', transactions=[t.todict()])
+            client.close()
+        except (OSError, node.NodeError) as e:
+            print('Node error:', e)
+            return
+        if error is not None:
+            print(error)
+            print('Abort')
+            return
+        print('Done!')
+        return
     print('Adding transaction to the chain...')
     if not c.add_transaction(t):
         print('Abort')
         return
-    c.to_file(p_chain)
+    store.save(c, p_chain)
     print('Done!')
+
+
+def _read_payouts(f: TextIO, fmt: str) -> Iterable[Tuple[int, Optional[Tuple[str, int]], Optional[str]]]:
+    # (receiver, amount) rows of a CSV file, with an optional header, or JSONL objects:
+    # (line number, payout, error). amounts are whole numbers, written as plain digits in CSV
+    if fmt == 'csv':
+        rows = ((i, row) for i, row in enumerate(csv.reader(f), 1) if row)
+    else:
+        rows = ((i, line) for i, line in enumerate(f, 1) if line.strip())
+    for i, row in rows:
+        try:
+            if fmt == 'csv':
+                if i == 1 and row == ['receiver', 'amount']:
+                    continue
+                receiver, amount = row
+                if not (amount.isascii() and amount.isdigit()):
+                    raise ValueError(f'Amount must be a whole number: {amount!r}')
+                amount = int(amount)
+            else:
+                row = json.loads(row)
+                receiver, amount = row['receiver'], row['amount']
+                if type(amount) is not int:
+                    raise ValueError(f'Amount must be a whole number: {amount!r}')
+            if not 0 < amount <= mempool.MAX_AMOUNT:
+                raise ValueError(f'Amount out of range: {amount}')
+            if not isinstance(receiver, str) or not receiver:
+                raise ValueError(f'Invalid receiver: {receiver!r}')
+            yield i, (receiver, amount), None
+        except (ValueError, KeyError, TypeError) as e:
+            yield i, None, f'Malformed payout: {e!r}'
+
+
+def transaction_create_batch(
+        p_wallet: Path,
+        p_chain: Path,
+        source: Path,
+        fmt: Optional[str] = None,
+        jobs: int = 1,
+        dest: Optional[Path] = None,
+        node_address: Optional[str] = None,
+) -> None:
+    # one signed transaction per (receiver, amount) row, committed together
+    print('Loading wallet...')
+    w = wallet.Wallet.from_file(p_wallet)
+    if dest is None and node_address is None:
+        print('Loading and verifying chain...')
+        c = store.load(p_chain)
+        if not checkpoint.verify(c, p_chain, jobs=jobs):
+            print('Invalid chain! Abort')
+            return
+
+    print('Reading payouts...')
+    if fmt is None:
+        fmt = 'csv' if source.suffix.lower() == '.csv' else 'jsonl'
+    try:
+        with open(source, 'r', newline='') as f:
+            parsed = list(_read_payouts(f, fmt))
+    except ValueError as e:  # not JSON
+        print('Cannot read payouts:', e)
+        return
+    errors = [(line, error) for line, _, error in parsed if error is not None]
+    for line, error in errors:
+        print(f'\tLine {line}: {error}')
+    if errors:
+        print('Abort')
+        return
+    payouts = [payout for _, payout, _ in parsed]
+    if not payouts:
+        print('Nothing to add')
+        return
+    total = sum(amount for _, amount in payouts)
+    print(f'{len(payouts)} payout(s), {total} in total')
+    if dest is None and node_address is None:
+        pool = mempool.Mempool(c, jobs=jobs)  # counts the spending already in the open block
+        if pool.available(w.b64_address) < total:
+            print('Not enough funds')
+            print('Abort')
+            return
+
+    print(f'Signing with {jobs} process(es)...')
+    transactions = [transaction.Transaction(b64_sender=w.b64_address, b64_receiver=receiver, amount=amount)
+                    for receiver, amount in payouts]
+    started = time.perf_counter()
+    signatures.sign_all(transactions, w, jobs=jobs)
+    seconds = time.perf_counter() - started
+    print(f'Signed {len(transactions)} transaction(s) in {seconds:.2f}s '
+          f'({len(transactions) / seconds if seconds > 0 else 0:.0f} transactions/sec)')
+
+    if dest is not None:
+        print('Appending transactions to', dest)
+        with open(dest, 'a') as f:
+            f.write(''.join(json.dumps(t.todict()) + '\n' for t in transactions))
+        print('Done!')
+        return
+    if node_address is not None:
+        print(f'Submitting transactions to node {node_address}...')
+        try:
+            client = node.NodeClient(node_address)
+            results = client.call('submit', transactions=[t.todict() for t in transactions])
+            client.close()
+        except (OSError, node.NodeError) as e:
+            print('Node error:', e)
+            return
+        for line, error in zip((line for line, _, _ in parsed), results):
+            if error is not None:
+                print(f'\tLine {line}: {error}')
+        print(f'{sum(error is None for error in results)} transaction(s) accepted')
+        print('Done!')
+        return
+    print('Adding transactions to the chain...')
+    results = pool.submit(transactions)
+    errors = [(line, error) for (line, _, _), error in zip(parsed, results) if error is not None]
+    for line, error in errors:
+        print(f'\tLine {line}: {error}')
+    if errors:  # all or none of them
+        print('Abort')
+        return
+    pool.flush()
+    store.save(c, p_chain)
+    print('Done!')
+
+
+def transaction_submit_batch(
+        p_chain: Path,
+        source: Optional[Path] = None,
+        jobs: int = 1,
+) -> None:
+    # admit signed transactions, one JSON object per line, from a file or stdin
+    print('Loading and verifying chain...')
+    c = store.load(p_chain)
+    if not checkpoint.verify(c, p_chain, jobs=jobs):
+        print('Invalid chain! Abort')
+        return
+
+    print('Reading transactions...')
+    if source is None:
+        parsed = list(mempool.read_jsonl(sys.stdin))
+    else:
+        with open(source, 'r') as f:
+            parsed = list(mempool.read_jsonl(f))
+    for line, _, error in parsed:
+        if error is not None:
+            print(f'\tLine {line}: {error}')
+    parsed = [(line, t) for line, t, error in parsed if error is None]
+
+    print(f'Admitting {len(parsed)} transaction(s)...')
+    pool = mempool.Mempool(c, jobs=jobs)
+    results = pool.submit([t for _, t in parsed])
+    for (line, _), error in zip(parsed, results):
+        if error is not None:
+            print(f'\tLine {line}: {error}')
+    if not pool.pending:
+        print('Nothing to add')
+        return
+    print(f'Adding {len(pool.pending)} transaction(s) to the chain...')
+    pool.flush()
+    store.save(c, p_chain)
+    print('Done!')
+
+
+def transaction_proof(
+        p_chain: Path,
+        height: int,
+        index: int,
+        dest: Optional[Path] = None,
+) -> None:
+    c = store.load(p_chain)
+    if not 0 <= height < c.length:
+        print('No such block')
+        return
+    b = c.blocks[height]
+    if not b.is_mined:
+        print('Block is not mined yet')
+        return
+    tree = b.merkle_tree
+    if tree.version != merkle.TREE_VERSION:
+        print('Block uses the legacy Merkle chain, no proofs available')
+        return
+    if not 0 <= index < len(tree.nodes):
+        print('No such transaction')
+        return
+
+    proof = {
+        'block': height,
+        'index': index,
+        'size': len(tree.nodes),
+        'transaction': tree.nodes[index].todict(),
+        'root': base64.b64encode(tree.root).decode(),
+        'path': [base64.b64encode(h).decode() for h in tree.proof(index)],
+        'header': {
+            'prev_hash': b.b64_prev_hash,
+            'timestamp': b.timestamp,
+            'miner': b.b64_miner,
+            'nonce': b.nonce,
+            'hash': b.b64_hash,
+        },
+    }
+    if dest is None:
+        print(json.dumps(proof, indent=2))
+    else:
+        with open(dest, 'w') as f:
+            json.dump(proof, f, indent=2)
+        print('Proof saved')
+
+
+def transaction_verify_proof(
+        p_proof: Path,
+) -> None:
+    # check an inclusion proof without the chain: transaction -> Merkle root -> proved block header
+    with open(p_proof, 'r') as f:
+        proof = json.load(f)
+    t = merkle.MerkleNode.fromdict(proof['transaction']).transaction
+    root = base64.b64decode(proof['root'])
+    path = [base64.b64decode(h) for h in proof['path']]
+    header = proof['header']
+
+    signature_valid = t.verify_signature()
+    included = merkle.verify_proof(merkle.leaf_hash(t), proof['index'], proof['size'], path, root)
+    prefix = block.header_prefix(
+        header['prev_hash'] if header['prev_hash'] is not None else '-',
+        base64.b64encode(root).decode(),
+        header['timestamp'],
+        header['miner'],
+    )
+    b64_hash = base64.b64encode(hashlib.sha256((prefix + str(header['nonce'])).encode()).digest()).decode()
+    header_valid = b64_hash == header['hash'] and block.is_proved_hash(b64_hash)
+
+    print('Transaction signature valid:', signature_valid)
+    print('Included in Merkle root:', included)
+    print('Block header valid:', header_valid)
+    print('Proof valid:', signature_valid and included and header_valid)
+
+
+def transaction_get(
+        p_chain: Path,
+        b64_hash: str,
+) -> None:
+    ix = index.Index(p_chain)
+    try:
+        ix.refresh()
+        found = [{
+            'block': location.height,
+            'block_hash': ix.block_hash(location.height),
+            'index': location.index,
+            'transaction': ix.transaction(location),
+        } for location in ix.find_transaction(b64_hash)]
+    except ValueError as e:  # chain not valid
+        print(e)
+        print('Abort')
+        return
+    finally:
+        ix.close()
+    if not found:
+        print('No such transaction')
+        return
+    for d in found:
+        print(json.dumps(d, indent=2))
+
+
+################################################################################
+#  Address Operations
+################################################################################
+
+def address_balance(
+        p_chain: Path,
+        address: str,
+        jobs: int = 1,
+) -> None:
+    s = summary.current(p_chain, jobs=jobs)
+    if not s.valid:
+        print('Chain valid:', s.valid)
+        print('Abort. Not valid')
+        return
+    b, b_min, b_max = s.balance(address)
+    print(f'Balance of {address} after {s.height} mined blocks')
+    print('\tCurrent:', b)
+    print('\tMin:', b_min)
+    print('\tMax:', b_max)
+
+
+def address_history(
+        p_chain: Path,
+        address: str,
+) -> None:
+    ix = index.Index(p_chain)
+    try:
+        ix.refresh()
+        history = ix.history(address)
+    except ValueError as e:  # chain not valid
+        print(e)
+        print('Abort')
+        return
+    finally:
+        ix.close()
+    print(f'{len(history)} transaction(s) of {address} in mined blocks')
+    for entry in history:
+        direction = 'out' if entry.b64_sender == address else 'in'
+        other = entry.b64_receiver if direction == 'out' else entry.b64_sender
+        print(f'\tBlock {entry.height}, transaction {entry.index}: {direction} {entry.amount} '
+              f'{"to" if direction == "out" else "from"} {other} at {entry.timestamp}')
+        print(f'\t\tHash: {entry.b64_hash}')
+
+
+################################################################################
+#  Benchmarks
+################################################################################
+
+def bench_run(
+        only: Optional[List[str]] = None,
+        n_wallets: int = 8,
+        n_blocks: int = 20,
+        n_transactions: int = 50,
+        jobs: int = 1,
+        repeat: int = 3,
+        fixtures_dir: Optional[Path] = None,
+        dest: Optional[Path] = None,
+        n_peers: int = 3,
+        hashes: int = 200000,
+) -> None:
+    if fixtures_dir is None:
+        fixtures_dir = bench.FIXTURES_DIR
+    print(f'Preparing fixture in {fixtures_dir}...', file=sys.stderr)
+    result = bench.run(
+        only=only,
+        n_wallets=n_wallets,
+        n_blocks=n_blocks,
+        n_transactions=n_transactions,
+        jobs=jobs,
+        repeat=repeat,
+        hashes=hashes,
+        fixtures_dir=fixtures_dir,
+        n_peers=n_peers,
+    )
+    if dest is None:
+        print(json.dumps(result, indent=2))
+    else:
+        with open(dest, 'w') as f:
+            json.dump(result, f, indent=2)
+        print('Results saved', file=sys.stderr)
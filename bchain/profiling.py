@@ -0,0 +1,154 @@
+import collections
+import contextlib
+import functools
+import importlib
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, TextIO
+
+from . import keycache
+
+
+# Lightweight instrumentation: phase timers and event counters.
+#
+# Nothing is measured until enable() is called. Timers of the key functions are then
+# installed by wrapping them in place, so they cost nothing while disabled. Counters sit
+# on hot paths behind an `if profiling.ENABLED:` check, the only cost when disabled. The
+# tools are only imported once enabled, every command imports this module.
+# Work done in worker processes is not seen, it is counted by the parent where possible.
+
+ENABLED = False
+
+counters: Dict[str, int] = collections.Counter()
+timers: Dict[str, List[float]] = {}  # name -> [seconds, calls], inclusive of nested phases
+
+# functions timed once enabled: (module, attribute path)
+TIMED = [
+    ('chain', 'Chain.verify'),
+    ('chain', 'Chain.fromlist'),
+    ('chain', 'Chain.tolist'),
+    ('chain', 'Chain.add_transaction'),
+    ('chain', 'Chain.calculate_balance'),
+    ('chain', 'Chain.info'),
+    ('block', 'Block.fromdict'),
+    ('block', 'Block.todict'),
+    ('block', 'Block.mine'),
+    ('block', 'Block.verify'),
+    ('merkle', 'MerkleTree.fromlist'),
+    ('merkle', 'MerkleTree.verify'),
+    ('merkle', 'MerkleTree.b64_hash'),
+    ('transaction', 'Transaction.sign'),
+    ('transaction', 'Transaction.verify_signature'),
+    ('signatures', 'find_invalid'),
+    ('signatures', 'verify_all'),
+    ('ledger', 'Ledger.apply_block'),
+    ('store', 'BlockStore.read_block'),
+    ('store', 'BlockStore.sync'),
+    ('store', 'load'),
+    ('store', 'save'),
+    ('checkpoint', 'verify'),
+]
+
+_NULL = contextlib.nullcontext()
+_profiler = None
+_p_stats: Optional[Path] = None
+
+
+class _Phase:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        timer = timers.get(self.name)
+        if timer is None:
+            timer = timers[self.name] = [0., 0]
+        timer[0] += time.perf_counter() - self.started
+        timer[1] += 1
+
+
+def phase(name: str):
+    # time a block of code: with profiling.phase('json.parse'): ...
+    return _Phase(name) if ENABLED else _NULL
+
+
+def count(name: str, n: int = 1) -> None:
+    counters[name] += n
+
+
+def _timed(fn: Callable, name: str) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _Phase(name):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _install(owner, attr: str, name: str) -> None:
+    import inspect
+    value = inspect.getattr_static(owner, attr)
+    if isinstance(value, staticmethod):
+        setattr(owner, attr, staticmethod(_timed(value.__func__, name)))
+    elif isinstance(value, property):
+        setattr(owner, attr, property(_timed(value.fget, name), value.fset))
+    else:
+        setattr(owner, attr, _timed(value, name))
+
+
+def enable() -> None:
+    global ENABLED
+    if ENABLED:
+        return
+    ENABLED = True
+    for module_name, path in TIMED:
+        owner = importlib.import_module(f'{__package__}.{module_name}')
+        *owners, attr = path.split('.')
+        for o in owners:
+            owner = getattr(owner, o)
+        _install(owner, attr, f'{module_name}.{path}')
+    # every operation of the command line
+    import inspect
+    ops = importlib.import_module(f'{__package__}.ops')
+    for attr, value in list(vars(ops).items()):
+        if inspect.isfunction(value) and value.__module__ == ops.__name__ and not attr.startswith('_'):
+            _install(ops, attr, f'ops.{attr}')
+
+
+def start(p_stats: Optional[Path] = None) -> None:
+    # enable the timers and counters, and with p_stats a cProfile run saved there by finish()
+    global _profiler, _p_stats
+    enable()
+    if p_stats is not None:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _p_stats = p_stats
+        _profiler.enable()
+
+
+def report() -> str:
+    lines = ['Phases (inclusive):']
+    for name, (seconds, calls) in sorted(timers.items(), key=lambda kv: -kv[1][0]):
+        lines.append(f'\t{name:<40} {calls:>9} calls {seconds:>10.4f}s {seconds / calls * 1000:>10.4f}ms/call')
+    lines.append('Counters:')
+    for name, n in sorted(counters.items()):
+        lines.append(f'\t{name:<40} {n:>12}')
+    lines.append('Key caches:')
+    for name, s in keycache.stats().items():
+        lines.append(f'\t{name:<40} {s["hits"]:>12} hits {s["misses"]:>9} misses {s["size"]:>9} entries')
+    return '\n'.join(lines)
+
+
+def finish(out: TextIO = sys.stderr) -> None:
+    global _profiler
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_p_stats)
+        print(f'cProfile stats saved to {_p_stats}', file=out)
+        _profiler = None
+    if ENABLED:
+        print(report(), file=out)
@@ -0,0 +1,217 @@
+import base64
+import binascii
+import collections
+import itertools
+import multiprocessing
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import rsa
+
+from . import keycache, profiling
+from .block import Block
+from .transaction import Transaction
+from .wallet import Wallet
+
+
+CHUNK_SIZE = 256
+WINDOW = 4  # chunks in flight per process
+
+# (message, signature, n, e) of one signed transaction, or its validity if already known
+Task = Union[Tuple[bytes, bytes, int, int], bool]
+# (message, signature, key string) under which the result of a check is kept by keycache
+MemoKey = Tuple[bytes, bytes, str]
+Location = Tuple[int, int]  # block index, transaction index
+
+
+def _verify_chunk(chunk: List[Task]) -> List[bool]:
+    keys: Dict[Tuple[int, int], rsa.PublicKey] = {}
+    res = []
+    for task in chunk:
+        if isinstance(task, bool):  # rejected while collecting, or checked before
+            res.append(task)
+            continue
+        message, signature, n, e = task
+        pk = keys.get((n, e))
+        if pk is None:
+            pk = keys[(n, e)] = rsa.PublicKey(n, e)
+        try:
+            rsa.verify(message, signature, pk)
+            res.append(True)
+        except rsa.VerificationError:
+            res.append(False)
+    return res
+
+
+def _collect(
+        transactions: Iterable[Tuple[Location, Transaction]],
+) -> Iterator[Tuple[Location, Task, Optional[MemoKey]]]:
+    # every sender key is parsed once, however many transactions it signed, and signatures
+    # checked before (e.g. at admission) are not checked again (see keycache)
+    for location, transaction in transactions:
+        if not transaction.is_signed_by_sender:
+            yield location, False, None
+            continue
+        try:
+            pk = keycache.public_key(transaction.str_sender_pk)
+            signature = transaction.signature
+        except (AttributeError, ValueError, binascii.Error):
+            yield location, False, None
+            continue
+        message = transaction.signable_str.encode()
+        valid = keycache.known(message, signature, transaction.str_sender_pk)
+        if valid is not None:
+            yield location, valid, None
+        else:
+            yield location, (message, signature, pk.n, pk.e), (message, signature, transaction.str_sender_pk)
+
+
+def _chunks(
+        transactions: Iterable[Tuple[Location, Transaction]],
+        chunk_size: int,
+) -> Iterator[Tuple[List[Location], List[Task], List[Optional[MemoKey]]]]:
+    collected = _collect(transactions)
+    while True:
+        chunk = list(itertools.islice(collected, chunk_size))
+        if not chunk:
+            return
+        locations, tasks, memo_keys = zip(*chunk)
+        yield list(locations), list(tasks), list(memo_keys)
+
+
+def _remember(memo_keys: List[Optional[MemoKey]], results: List[bool]) -> None:
+    checked = 0
+    for memo_key, valid in zip(memo_keys, results):
+        if memo_key is not None:
+            keycache.remember(*memo_key, valid)
+            checked += 1
+    if profiling.ENABLED:
+        profiling.count('signatures.verified', checked)
+
+
+def _verify(
+        transactions: Iterable[Tuple[Location, Transaction]],
+        jobs: int,
+        chunk_size: int,
+) -> Iterator[Tuple[Location, bool]]:
+    # verify in chunks fanned out over `jobs` processes, results in input order.
+    # the pool is terminated when the consumer stops early
+    assert jobs > 0 and chunk_size > 0
+    chunks = _chunks(transactions, chunk_size)
+
+    if jobs == 1:
+        for locations, tasks, memo_keys in chunks:
+            results = _verify_chunk(tasks)
+            _remember(memo_keys, results)
+            yield from zip(locations, results)
+        return
+
+    pending = collections.deque()  # locations and memo keys of submitted chunks, fed by the pool's task thread
+    # the pool pulls its input as fast as it can, keep at most a few chunks per process in flight
+    window = threading.Semaphore(WINDOW * jobs)
+    stopped = False
+
+    def tasks_of(chunks_):
+        for locations_, tasks_, memo_keys_ in chunks_:
+            window.acquire()
+            if stopped:
+                return
+            pending.append((locations_, memo_keys_))
+            yield tasks_
+
+    with multiprocessing.get_context().Pool(jobs) as pool:
+        try:
+            for results in pool.imap(_verify_chunk, tasks_of(chunks)):
+                window.release()
+                locations, memo_keys = pending.popleft()
+                _remember(memo_keys, results)
+                yield from zip(locations, results)
+        finally:
+            stopped = True
+            window.release()  # wake up the task thread, if it waits
+
+
+def iter_verified(
+        transactions: Iterable[Tuple[Location, Transaction]],
+        jobs: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+) -> Iterator[Tuple[Location, bool]]:
+    # validity of each signature as soon as it is known, in input order.
+    # transactions are pulled lazily, a few chunks ahead of the results
+    return _verify(transactions, jobs, chunk_size)
+
+
+def find_invalid(
+        blocks: Iterable[Block],
+        jobs: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+) -> Optional[Location]:
+    # verify the signatures of all transactions in the blocks,
+    # return the location of the first transaction that fails, None if all are valid
+    transactions = (
+        ((i, j), transaction)
+        for i, block in enumerate(blocks)
+        for j, transaction in enumerate(block.transactions)
+    )
+    verified = _verify(transactions, jobs, chunk_size)
+    try:
+        for location, valid in verified:
+            if not valid:
+                return location
+        return None
+    finally:
+        verified.close()
+
+
+def verify_all(
+        transactions: List[Transaction],
+        jobs: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+) -> List[bool]:
+    # validity of the signature of every transaction
+    res = [False] * len(transactions)
+    for (i, _), valid in _verify((((i, 0), t) for i, t in enumerate(transactions)), jobs, chunk_size):
+        res[i] = valid
+    return res
+
+
+################################################################################
+#  Signing
+################################################################################
+
+_sk: Optional[rsa.PrivateKey] = None  # key of the signing worker processes
+
+
+def _init_signer(sk: rsa.PrivateKey) -> None:
+    global _sk
+    _sk = sk
+
+
+def _sign_chunk(messages: List[bytes]) -> List[bytes]:
+    return _sign_chunk_with(_sk, messages)
+
+
+def _sign_chunk_with(sk: rsa.PrivateKey, messages: List[bytes]) -> List[bytes]:
+    return [rsa.sign(message, sk, 'SHA-256') for message in messages]
+
+
+def sign_all(
+        transactions: List[Transaction],
+        w: Wallet,
+        jobs: int = 1,
+        chunk_size: int = CHUNK_SIZE,
+) -> None:
+    # sign the transactions of wallet w in chunks fanned out over `jobs` processes,
+    # which receive the key once
+    assert jobs > 0 and chunk_size > 0
+    assert all(t.b64_sender == w.b64_address for t in transactions), 'Only sender can sign transaction'
+    messages = [t.signable_str.encode() for t in transactions]
+    if jobs == 1:
+        signed = _sign_chunk_with(w.sk, messages)
+    else:
+        chunks = [messages[i:i + chunk_size] for i in range(0, len(messages), chunk_size)]
+        with multiprocessing.get_context().Pool(jobs, initializer=_init_signer, initargs=(w.sk,)) as pool:
+            signed = list(itertools.chain.from_iterable(pool.imap(_sign_chunk, chunks)))
+    for transaction, signature in zip(transactions, signed):
+        transaction.b64_signature = base64.b64encode(signature).decode()
+        transaction.str_sender_pk = w.str_pk
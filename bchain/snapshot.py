@@ -0,0 +1,114 @@
+import base64
+import json
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Set
+
+import rsa
+
+from . import keycache, store, wallet
+from .chain import Chain, MINING_REWARD
+from .ledger import Ledger
+
+
+# A snapshot is the balance state of a chain after its first `height` blocks, with
+# the hash of the last of them, signed off by a wallet. A chain whose prefix matches
+# starts its ledger from the snapshot, only the blocks after it are verified and
+# replayed. Block stores can then drop the transactions of the prefix (see BlockStore.prune).
+# Anyone can sign a snapshot, so only those of trusted signers are used (see trust).
+
+class Snapshot(NamedTuple):
+    ledger: Ledger
+    b64_hash: str  # hash of block height - 1
+    str_signer_pk: str
+    b64_signature: str
+
+    @property
+    def height(self) -> int:
+        return self.ledger.height
+
+    @property
+    def b64_signer(self) -> str:
+        return keycache.address(self.str_signer_pk)
+
+    @staticmethod
+    def signable(ledger: Ledger, b64_hash: str) -> bytes:
+        return json.dumps({'hash': b64_hash, **ledger.todict()}, sort_keys=True, separators=(',', ':')).encode()
+
+    def verify_signature(self) -> bool:
+        try:
+            return keycache.verify(Snapshot.signable(self.ledger, self.b64_hash),
+                                   base64.b64decode(self.b64_signature), self.str_signer_pk)
+        except (ValueError, AttributeError):
+            return False
+
+    def todict(self) -> Dict:
+        return {
+            'hash': self.b64_hash,
+            **self.ledger.todict(),
+            'signer_pk': self.str_signer_pk,
+            'signature': self.b64_signature,
+        }
+
+    @staticmethod
+    def fromdict(d: Dict) -> 'Snapshot':
+        return Snapshot(Ledger.fromdict(d), d['hash'], d['signer_pk'], d['signature'])
+
+
+# addresses of the wallets whose snapshots are trusted
+trusted_signers: Set[str] = set()
+
+
+def trust(b64_addresses: Iterable[str]) -> None:
+    trusted_signers.update(b64_addresses)
+
+
+def is_trusted(s: Snapshot) -> bool:
+    return s.b64_signer in trusted_signers and s.verify_signature()
+
+
+def path_for(p_chain: Path) -> Path:
+    return p_chain.with_name(p_chain.name + '.snapshot')
+
+
+def create(c: Chain, height: int, w: wallet.Wallet) -> Snapshot:
+    # state after the first `height` blocks, which must be mined
+    assert 0 < height <= c.length
+    if c.ledger.height == height:
+        ledger = c.ledger.copy()
+    else:
+        ledger = c.base.copy() if c.base is not None and c.base.height <= height else Ledger(MINING_REWARD)
+        for block in c.blocks[ledger.height:height]:
+            ledger.apply_block(block)
+    b64_hash = c.blocks[height - 1].b64_hash
+    signature = rsa.sign(Snapshot.signable(ledger, b64_hash), w.sk, 'SHA-256')
+    return Snapshot(ledger, b64_hash, w.str_pk, base64.b64encode(signature).decode())
+
+
+def load(p_chain: Path) -> Optional[Snapshot]:
+    try:
+        with open(path_for(p_chain), 'r') as f:
+            return Snapshot.fromdict(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def save(p_chain: Path, s: Snapshot) -> None:
+    with open(path_for(p_chain), 'w') as f:
+        json.dump(s.todict(), f)
+
+
+def matches(c: Chain, s: Snapshot) -> bool:
+    if not 0 < s.height <= c.length:
+        return False
+    block = c.blocks[s.height - 1]
+    return block.is_mined and block.b64_hash == s.b64_hash and store.hashes_match(c, s.height)
+
+
+def restore(c: Chain, p_chain: Path) -> int:
+    # start the ledger of `c` from the snapshot next to p_chain if it is valid for it and
+    # trusted, return the height up to which blocks need no verification
+    s = load(p_chain)
+    if s is None or s.ledger.mining_reward != MINING_REWARD or not matches(c, s) or not is_trusted(s):
+        return 0
+    c.restore(s.ledger)
+    return s.height
@@ -0,0 +1,576 @@
+import base64
+import binascii
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+from . import profiling
+from .block import Block, BlockHeader
+from .chain import Chain
+from .merkle import MerkleTree, LEGACY_VERSION, DEFAULT_VERSION
+from .transaction import Transaction
+
+
+# Append-only binary chain log.
+#
+# After the magic, the file is a sequence of records `<length:u32><kind:u8><payload>`:
+#   TRANSACTION  appends a transaction to the pending transactions
+#   SEAL         mines the open block with the first n pending transactions,
+#                the rest stay pending and form the next open block
+#   OPEN         opens a new empty block when there is none
+#   PRUNED       first record of a pruned store: the blocks below the given height
+#                were sealed without their transactions, their seals keep the hashes
+# Each of them may end with the Merkle tree version of its block (1 if absent).
+# Seals then end with the hash of the block's transactions, which makes them complete
+# block headers (absent in older stores, where it is computed from the transactions).
+# The chain starts with an open (genesis) block. A trailing partial record,
+# e.g. from an interrupted write, is ignored and overwritten by the next append.
+
+MAGIC = b'BCHAIN\x00\x01'
+
+KIND_TRANSACTION = 1
+KIND_SEAL = 2
+KIND_OPEN = 3
+KIND_PRUNED = 4
+
+_RECORD = struct.Struct('<IB')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+
+# flags of optional base64 / key fields
+_RAW = 0
+_TEXT = 1
+_NONE = 2
+
+
+################################################################################
+#  Encoding
+################################################################################
+
+def _pack_bytes(b: bytes) -> bytes:
+    return _U16.pack(len(b)) + b
+
+
+def _pack_str(s: str) -> bytes:
+    return _pack_bytes(s.encode())
+
+
+def _pack_b64(s: Optional[str]) -> bytes:
+    # base64 fields are stored decoded, anything that would not round-trip is kept as text
+    if s is None:
+        return bytes([_NONE])
+    try:
+        raw = base64.b64decode(s.encode(), validate=True)
+    except (binascii.Error, UnicodeEncodeError):
+        raw = None
+    if raw is not None and base64.b64encode(raw).decode() == s:
+        return bytes([_RAW]) + _pack_bytes(raw)
+    return bytes([_TEXT]) + _pack_str(s)
+
+
+def _pack_pk(s: Optional[str]) -> bytes:
+    # public keys are stored as the big-endian bytes of n and e
+    if s is None:
+        return bytes([_NONE])
+    try:
+        n, e = [int(i) for i in s.split()]
+    except ValueError:
+        n = e = -1
+    if n >= 0 and e >= 0 and f'{n} {e}' == s:
+        return (bytes([_RAW])
+                + _pack_bytes(n.to_bytes((n.bit_length() + 7) // 8, 'big'))
+                + _pack_bytes(e.to_bytes((e.bit_length() + 7) // 8, 'big')))
+    return bytes([_TEXT]) + _pack_str(s)
+
+
+def pack_transaction(transaction: Transaction, version: int = DEFAULT_VERSION) -> bytes:
+    return (_pack_b64(transaction.b64_sender)
+            + _pack_b64(transaction.b64_receiver)
+            + _U64.pack(transaction.amount)
+            + _pack_str(transaction.timestamp)
+            + _pack_pk(transaction.str_sender_pk)
+            + _pack_b64(transaction.b64_signature)
+            + bytes([version]))
+
+
+def pack_seal(block: Block, b64_transactions_hash: Optional[str] = None) -> bytes:
+    # b64_transactions_hash stands in for the transactions of a pruned block
+    assert block.is_mined
+    return (_U32.pack(len(block.transactions))
+            + base64.b64decode(block.b64_hash)
+            + _pack_str(block.timestamp)
+            + _pack_b64(block.b64_miner)
+            + _U64.pack(block.nonce)
+            + bytes([block.merkle_tree.version])
+            + _pack_str(b64_transactions_hash if b64_transactions_hash is not None else block.merkle_tree.b64_hash))
+
+
+class _Reader:
+    def __init__(self, buf, pos: int = 0) -> None:
+        self.buf = buf
+        self.pos = pos
+        length, _ = _RECORD.unpack_from(buf, pos - _RECORD.size)
+        self.end = pos + length  # end of the record payload
+
+    def version(self) -> int:
+        # optional trailing Merkle tree version
+        return self.u8() if self.pos < self.end else LEGACY_VERSION
+
+    def u8(self) -> int:
+        self.pos += 1
+        return self.buf[self.pos - 1]
+
+    def u32(self) -> int:
+        v, = _U32.unpack_from(self.buf, self.pos)
+        self.pos += _U32.size
+        return v
+
+    def u64(self) -> int:
+        v, = _U64.unpack_from(self.buf, self.pos)
+        self.pos += _U64.size
+        return v
+
+    def raw(self, n: int) -> bytes:
+        self.pos += n
+        return bytes(self.buf[self.pos - n:self.pos])
+
+    def bytes(self) -> bytes:
+        n, = _U16.unpack_from(self.buf, self.pos)
+        self.pos += _U16.size
+        return self.raw(n)
+
+    def str(self) -> str:
+        return self.bytes().decode()
+
+    def b64(self) -> Optional[str]:
+        flag = self.u8()
+        if flag == _NONE:
+            return None
+        if flag == _RAW:
+            return base64.b64encode(self.bytes()).decode()
+        return self.str()
+
+    def pk(self) -> Optional[str]:
+        flag = self.u8()
+        if flag == _NONE:
+            return None
+        if flag == _RAW:
+            n = int.from_bytes(self.bytes(), 'big')
+            e = int.from_bytes(self.bytes(), 'big')
+            return f'{n} {e}'
+        return self.str()
+
+
+def unpack_transaction(buf, pos: int) -> Tuple[Transaction, int]:
+    # returns the transaction and the Merkle tree version of its block
+    r = _Reader(buf, pos)
+    if profiling.ENABLED:
+        profiling.count('bytes.read', r.end - pos)
+    transaction = Transaction(
+        b64_sender=r.b64(),
+        b64_receiver=r.b64(),
+        amount=r.u64(),
+        timestamp=r.str(),
+        str_sender_pk=r.pk(),
+        b64_signature=r.b64(),
+    )
+    return transaction, r.version()
+
+
+class Seal:
+    def __init__(self, buf, pos: int) -> None:
+        r = _Reader(buf, pos)
+        self.n_transactions = r.u32()
+        self.b64_hash = base64.b64encode(r.raw(32)).decode()
+        self.timestamp = r.str()
+        self.b64_miner = r.b64()
+        self.nonce = r.u64()
+        self.version = r.version()
+        self.b64_transactions_hash = r.str() if r.pos < r.end else None
+
+
+################################################################################
+#  Store
+################################################################################
+
+class BlockStore:
+    def __init__(
+            self,
+            path: Path,
+    ) -> None:
+        self.path = path
+        # offset index: payload offsets of every transaction and seal record
+        self.tx_offsets = array('Q')
+        self.seal_offsets = array('Q')
+        self.tx_starts = array('Q')  # index of the first transaction of every sealed block
+        self.n_sealed_transactions = 0
+        self.is_open = True  # whether the last block is an open (unmined) one
+        self.open_version = LEGACY_VERSION  # Merkle tree version of the last OPEN record
+        self.pruned_height = 0  # blocks below have no transactions
+        self._end = len(MAGIC)  # end of the last complete record
+        self._file = None
+        self._buf: Optional[mmap.mmap] = None  # read-only map of the file, dropped on append
+        self._scan()
+
+    def _add_seal(self, offset: int, n_transactions: int) -> None:
+        self.tx_starts.append(self.n_sealed_transactions)
+        self.seal_offsets.append(offset)
+        self.n_sealed_transactions += n_transactions
+        self.is_open = len(self.tx_offsets) > self.n_sealed_transactions
+
+    @staticmethod
+    def is_store(path: Path) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(MAGIC)) == MAGIC
+        except OSError:
+            return False
+
+    @staticmethod
+    def create(path: Path, c: Chain) -> 'BlockStore':
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+        store = BlockStore(path)
+        store.sync(c)
+        return store
+
+    def _scan(self) -> None:
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{self.path} is not a block store')
+            size = os.fstat(f.fileno()).st_size
+            if size == len(MAGIC):
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                pos = len(MAGIC)
+                while pos + _RECORD.size <= size:
+                    length, kind = _RECORD.unpack_from(buf, pos)
+                    payload = pos + _RECORD.size
+                    if payload + length > size:  # partial record
+                        break
+                    if kind == KIND_TRANSACTION:
+                        self.is_open = True
+                        self.tx_offsets.append(payload)
+                    elif kind == KIND_SEAL:
+                        n, = _U32.unpack_from(buf, payload)
+                        self._add_seal(payload, n)
+                    elif kind == KIND_OPEN:
+                        self.is_open = True
+                        self.open_version = buf[payload] if length > 0 else LEGACY_VERSION
+                    elif kind == KIND_PRUNED:
+                        self.pruned_height, = _U32.unpack_from(buf, payload)
+                        self.is_open = False
+                    else:
+                        raise ValueError(f'Unknown record kind {kind} at offset {pos}')
+                    pos = payload + length
+                self._end = pos
+
+    @property
+    def height(self) -> int:
+        # number of sealed blocks
+        return len(self.seal_offsets)
+
+    @property
+    def length(self) -> int:
+        return self.height + (1 if self.is_open else 0)
+
+    def transaction_range(self, height: int) -> Tuple[int, int]:
+        # indices of the transactions of block `height`
+        assert 0 <= height < self.length
+        if height == self.height:  # open block
+            return self.n_sealed_transactions, len(self.tx_offsets)
+        stop = self.tx_starts[height + 1] if height + 1 < self.height else self.n_sealed_transactions
+        return self.tx_starts[height], stop
+
+    def _map(self) -> mmap.mmap:
+        if self._buf is None:
+            self._file = open(self.path, 'rb')
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._buf
+
+    def close(self) -> None:
+        if self._buf is not None:
+            self._buf.close()
+            self._file.close()
+            self._buf = self._file = None
+
+    def read_seal(self, height: int) -> Seal:
+        return Seal(self._map(), self.seal_offsets[height])
+
+    def read_block(self, height: int, prev_block: Optional[Block] = None) -> Block:
+        # without prev_block, the block refers to its predecessor by the hash stored in the previous seal
+        if profiling.ENABLED:
+            profiling.count('blocks.decoded')
+        buf = self._map()
+        seal = self.read_seal(height) if height < self.height else None
+        b64_prev_hash = self.read_seal(height - 1).b64_hash if prev_block is None and height > 0 else None
+        if height < self.pruned_height:
+            return Block(
+                b64_miner=seal.b64_miner,
+                transactions=MerkleTree(version=seal.version),
+                timestamp=seal.timestamp,
+                nonce=seal.nonce,
+                b64_prev_hash=b64_prev_hash,
+                b64_hash=seal.b64_hash,
+            )
+        start, stop = self.transaction_range(height)
+        unpacked = [unpack_transaction(buf, self.tx_offsets[i]) for i in range(start, stop)]
+        if seal is not None:
+            version = seal.version
+        elif unpacked:
+            version = unpacked[0][1]
+        else:
+            version = self.open_version
+        transactions = MerkleTree(version=version)
+        for transaction, _ in unpacked:
+            transactions.add_transaction(transaction)
+        return Block(
+            b64_miner=seal.b64_miner if seal is not None else None,
+            prev_block=prev_block,
+            transactions=transactions,
+            timestamp=seal.timestamp if seal is not None else None,
+            nonce=seal.nonce if seal is not None else None,
+            b64_prev_hash=b64_prev_hash,
+        )
+
+    def hashes_match(self, start: int, stop: int) -> bool:
+        # the seals of blocks start..stop-1 hold the hashes of their contents. blocks read alone
+        # refer to their predecessor by its stored hash, so a matching tip hash only vouches for
+        # the blocks before it once their seals are checked
+        for height in range(max(start, self.pruned_height), min(stop, self.height)):
+            if self.read_block(height).b64_hash != self.read_seal(height).b64_hash:
+                return False
+        return True
+
+    def read_header(self, height: int) -> BlockHeader:
+        # without decoding the transactions, unless the store predates headers in seals
+        if height >= self.height:  # open block
+            return self.read_block(height).header
+        seal = self.read_seal(height)
+        b64_transactions_hash = seal.b64_transactions_hash
+        if b64_transactions_hash is None:
+            b64_transactions_hash = self.read_block(height).merkle_tree.b64_hash
+        return BlockHeader(
+            b64_prev_hash=self.read_seal(height - 1).b64_hash if height > 0 else None,
+            b64_transactions_hash=b64_transactions_hash,
+            timestamp=seal.timestamp,
+            b64_miner=seal.b64_miner,
+            nonce=seal.nonce,
+            n_transactions=seal.n_transactions,
+        )
+
+    def read_transfers(self, height: int) -> List[Tuple[Optional[str], Optional[str], int]]:
+        # sender, receiver and amount of the transactions of a block, the rest is not decoded
+        if height < self.pruned_height:
+            return []
+        buf = self._map()
+        start, stop = self.transaction_range(height)
+        res = []
+        for i in range(start, stop):
+            r = _Reader(buf, self.tx_offsets[i])
+            res.append((r.b64(), r.b64(), r.u64()))
+        return res
+
+    def read_chain(self) -> Chain:
+        # materialize all blocks, linked to each other
+        blocks: List[Block] = []
+        for height in range(self.length):
+            blocks.append(self.read_block(height, prev_block=blocks[-1] if blocks else None))
+        return Chain(blocks)
+
+    @staticmethod
+    def prune(path: Path, c: Chain, height: int) -> 'BlockStore':
+        # rewrite the store of chain `c` without the transactions of the blocks below `height`
+        assert 0 < height <= c.length and all(b.is_mined for b in c.blocks[height - 1:height])
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            records = [(KIND_PRUNED, _U32.pack(height))]
+            for i, block in enumerate(c.blocks[:height]):
+                b64_transactions_hash = header(c, i).b64_transactions_hash
+                records.append((KIND_SEAL, _U32.pack(0) + pack_seal(block, b64_transactions_hash)[_U32.size:]))
+            for kind, payload in records:
+                f.write(_RECORD.pack(len(payload), kind))
+                f.write(payload)
+        pruned = BlockStore(tmp)
+        pruned.sync(c)
+        pruned.close()
+        os.replace(tmp, path)
+        return BlockStore(path)
+
+    def _append(self, records: List[Tuple[int, bytes]]) -> None:
+        if not records:
+            return
+        self.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(self._end)  # drop a partial record
+            f.seek(self._end)
+            pos = self._end
+            for kind, payload in records:
+                f.write(_RECORD.pack(len(payload), kind))
+                f.write(payload)
+                payload_pos = pos + _RECORD.size
+                if kind == KIND_TRANSACTION:
+                    self.tx_offsets.append(payload_pos)
+                    self.is_open = True
+                elif kind == KIND_SEAL:
+                    n, = _U32.unpack_from(payload)
+                    self._add_seal(payload_pos, n)
+                else:
+                    self.is_open = True
+                    self.open_version = payload[0] if payload else LEGACY_VERSION
+                pos = payload_pos + len(payload)
+            f.flush()
+            if profiling.ENABLED:
+                profiling.count('bytes.written', pos - self._end)
+            self._end = pos
+
+    def sync(self, c: Chain) -> int:
+        # append whatever the chain has beyond the stored blocks, return the number of records written
+        assert c.length >= self.height, 'Chain is behind the store'
+        records: List[Tuple[int, bytes]] = []
+        pending = len(self.tx_offsets) - self.n_sealed_transactions  # transactions written but not sealed
+        is_open = self.is_open
+        for block in c.blocks[self.height:]:
+            version = block.merkle_tree.version
+            if not is_open:
+                records.append((KIND_OPEN, bytes([version])))
+            transactions = block.transactions
+            for transaction in transactions[pending:]:
+                records.append((KIND_TRANSACTION, pack_transaction(transaction, version)))
+            pending = max(pending, len(transactions))
+            if block.is_mined:
+                records.append((KIND_SEAL, pack_seal(block)))
+                pending -= len(transactions)
+                is_open = pending > 0
+            else:
+                is_open = True
+        self._append(records)
+        return len(records)
+
+
+class LazyBlocks:
+    # list-like view of the blocks of a store: sealed blocks are decoded from the map every
+    # time they are accessed and not kept, the open block and blocks appended later live in memory
+    def __init__(
+            self,
+            store: BlockStore,
+            first: int = 0,
+            n_stored: Optional[int] = None,
+            tail: Optional[List[Block]] = None,
+    ) -> None:
+        self._store = store
+        self._first = first  # height of the first block of the view
+        self._n_stored = store.height if n_stored is None else n_stored  # heights below are decoded from the store
+        if tail is None:
+            tail = [store.read_block(store.height)] if store.is_open else []
+        self._tail = tail  # blocks from height _n_stored on
+        self._checked = first  # stored blocks below have their seals checked, see hashes_match
+
+    def __len__(self) -> int:
+        return self._n_stored + len(self._tail) - self._first
+
+    def _height(self, i: int) -> int:
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('block index out of range')
+        return self._first + i
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Block, 'LazyBlocks']:
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            assert step == 1, 'Only contiguous slices are supported'
+            first = self._first + start
+            stop = self._first + max(start, stop)
+            n_stored = max(first, min(stop, self._n_stored))
+            return LazyBlocks(
+                self._store,
+                first=first,
+                n_stored=n_stored,
+                tail=self._tail[n_stored - self._n_stored:max(stop - self._n_stored, 0)],
+            )
+        height = self._height(i)
+        if height >= self._n_stored:
+            return self._tail[height - self._n_stored]
+        return self._store.read_block(height)
+
+    def __setitem__(self, i: int, block: Block) -> None:
+        height = self._height(i)
+        assert height >= self._n_stored, 'Stored blocks are immutable'
+        self._tail[height - self._n_stored] = block
+
+    def __iter__(self) -> Iterator[Block]:
+        for height in range(self._first, self._n_stored):
+            yield self._store.read_block(height)
+        yield from self._tail
+
+    def append(self, block: Block) -> None:
+        self._tail.append(block)
+
+    def iter_transfers(self) -> Iterator[Tuple[Optional[str], List[Tuple[Optional[str], Optional[str], int]]]]:
+        # miner (None if not mined) and transfers of every block, see BlockStore.read_transfers
+        for height in range(self._first, self._n_stored):
+            yield self._store.read_seal(height).b64_miner, self._store.read_transfers(height)
+        for block in self._tail:
+            yield block.b64_miner if block.is_mined else None, \
+                [(t.b64_sender, t.b64_receiver, t.amount) for t in block.transactions]
+
+    def header(self, i: int) -> BlockHeader:
+        height = self._height(i)
+        if height >= self._n_stored:
+            return self._tail[height - self._n_stored].header
+        return self._store.read_header(height)
+
+    def hashes_match(self, n: int) -> bool:
+        # the first n blocks of the view are intact, see BlockStore.hashes_match
+        stop = self._first + n
+        if stop > self._checked:
+            if not self._store.hashes_match(self._checked, stop):
+                return False
+            self._checked = stop
+        return True
+
+    @property
+    def pruned_height(self) -> int:
+        return self._store.pruned_height
+
+
+################################################################################
+#  Chain files
+################################################################################
+
+def load(path: Path) -> Chain:
+    # block stores are opened lazily, JSON files are loaded in full
+    if BlockStore.is_store(path):
+        return Chain(LazyBlocks(BlockStore(path)))
+    return Chain.from_file(path)
+
+
+def header(c: Chain, height: int) -> BlockHeader:
+    # header of a block, also of a pruned one
+    return c.blocks.header(height) if isinstance(c.blocks, LazyBlocks) else c.blocks[height].header
+
+
+def hashes_match(c: Chain, height: int) -> bool:
+    # the hash of block height - 1 covers all blocks before it: always for blocks linked in
+    # memory, for a block store once the stored hashes are checked against the contents
+    return c.blocks.hashes_match(height) if isinstance(c.blocks, LazyBlocks) else True
+
+
+def pruned_height(c: Chain) -> int:
+    # blocks below were loaded without their transactions
+    return c.blocks.pruned_height if isinstance(c.blocks, LazyBlocks) else 0
+
+
+def save(c: Chain, path: Path) -> None:
+    # block stores only get the new records appended, JSON files are rewritten
+    if BlockStore.is_store(path):
+        BlockStore(path).sync(c)
+    else:
+        c.to_file(path)
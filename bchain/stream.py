@@ -0,0 +1,248 @@
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
+
+from . import profiling, signatures, snapshot
+from .block import Block, BlockHeader
+from .checkpoint import Checkpoint
+from .store import BlockStore
+from .transaction import Transaction
+
+
+# Verification of a chain as a stream of blocks read straight from its file. Only the
+# block at hand and the hash of the previous one are held, so memory does not grow with
+# the length of the chain, and the first invalid block stops the stream.
+
+READ_SIZE = 1 << 20
+
+
+def iter_json(path: Path, read_size: int = READ_SIZE) -> Iterator[Dict]:
+    # the elements of the top-level JSON array in a file, parsed one at a time
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf = ''
+        pos = 0
+
+        def fill() -> bool:
+            # read more, at least as much as is buffered so that large elements take few attempts
+            nonlocal buf, pos
+            chunk = f.read(max(read_size, len(buf) - pos))
+            if profiling.ENABLED:
+                profiling.count('bytes.read', len(chunk))
+            buf = buf[pos:] + chunk
+            pos = 0
+            return bool(chunk)
+
+        def next_char() -> str:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if not fill():
+                    return ''
+
+        if next_char() != '[':
+            raise ValueError('Chain file is not a JSON array')
+        pos += 1
+        if next_char() == ']':
+            return
+        while True:
+            while True:
+                try:
+                    d, pos = decoder.raw_decode(buf, pos)
+                    break
+                except json.JSONDecodeError:
+                    if not fill():
+                        raise
+            yield d
+            c = next_char()
+            if c == ']':
+                return
+            if c != ',':
+                raise ValueError('Malformed chain file')
+            pos += 1
+            next_char()
+
+
+def iter_blocks(path: Path, start: int = 0) -> Iterator[Block]:
+    # blocks of a chain file from height `start`, each referring to its predecessor by hash only
+    if BlockStore.is_store(path):
+        store = BlockStore(path)
+        try:
+            for height in range(start, store.length):
+                yield store.read_block(height)
+        finally:
+            store.close()
+    else:
+        # JSON blocks do not store the hash of their predecessor, it is the one computed before
+        b64_prev_hash = None
+        for height, d in enumerate(iter_json(path)):
+            block = Block.fromdict(d, b64_prev_hash=b64_prev_hash)
+            if height >= start:
+                yield block
+            b64_prev_hash = block.b64_hash if block.is_mined else None  # only the last block may be open
+
+
+def iter_headers(path: Path) -> Iterator[BlockHeader]:
+    # headers of the blocks of a chain file. block stores read them from their seals,
+    # JSON blocks are parsed and their transactions hashed, but signatures are not checked
+    if BlockStore.is_store(path):
+        store = BlockStore(path)
+        try:
+            for height in range(store.length):
+                yield store.read_header(height)
+        finally:
+            store.close()
+    else:
+        for block in iter_blocks(path):
+            yield block.header
+
+
+class Progress(NamedTuple):
+    height: int  # blocks checked so far, or the failing height
+    transactions: int  # transactions whose signature was checked
+    seconds: float
+
+    @property
+    def blocks_per_sec(self) -> float:
+        return self.height / self.seconds if self.seconds > 0 else 0.
+
+    @property
+    def transactions_per_sec(self) -> float:
+        return self.transactions / self.seconds if self.seconds > 0 else 0.
+
+
+class VerifyResult(NamedTuple):
+    valid: bool
+    progress: Progress
+    error: Optional[str] = None
+    checkpoint: Optional[Checkpoint] = None  # mined prefix of a valid chain
+
+
+class _Stream:
+    def __init__(
+            self,
+            on_progress: Optional[Callable[[Progress], None]],
+            interval: float,
+    ) -> None:
+        self.on_progress = on_progress
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = self.started
+        self.height = 0
+        self.transactions = 0
+        self.failed: Optional[Tuple[int, str]] = None  # height and reason of the first invalid block
+        self.checkpoint: Optional[Checkpoint] = None  # last mined block so far
+
+    def progress(self) -> Progress:
+        return Progress(self.height, self.transactions, time.perf_counter() - self.started)
+
+    def tick(self) -> None:
+        if self.on_progress is not None and time.perf_counter() - self.last_report >= self.interval:
+            self.last_report = time.perf_counter()
+            self.on_progress(self.progress())
+
+    def fail(self, height: int, reason: str) -> None:
+        if self.failed is None or height < self.failed[0]:
+            self.failed = height, reason
+
+    def checked(
+            self,
+            blocks: Iterable[Union[Block, BlockHeader]],
+            start: int = 0,
+            b64_prev_hash: Optional[str] = None,
+    ) -> Iterator[Tuple[signatures.Location, Transaction]]:
+        # the same checks as Chain.verify, one block at a time. yields the transactions of every
+        # block that passes, for their signatures to be checked, and stops at the first one that fails.
+        # blocks start at height `start`, after the block of hash b64_prev_hash.
+        # headers only get their links and proof of work checked
+        self.height = start
+        open_height = None  # height of an unmined block, only valid as the last one
+        for height, block in enumerate(blocks, start):
+            if open_height is not None:
+                self.fail(open_height, 'Block not mined')
+                return
+            if block.b64_prev_hash != b64_prev_hash:
+                self.fail(height, 'Previous hash mismatch')
+                return
+            if block.is_mined and not block.is_proved:
+                self.fail(height, 'Proof of work not satisfied')
+                return
+            if isinstance(block, Block) and not block.merkle_tree.verify(check_signatures=False):
+                self.fail(height, 'Invalid transactions')
+                return
+            if not block.is_mined:
+                if height == 0:
+                    self.fail(height, 'Genesis block not mined')
+                    return
+                open_height = height
+            else:
+                b64_prev_hash = block.b64_hash
+                self.checkpoint = Checkpoint(height + 1, b64_prev_hash)
+            if isinstance(block, Block):
+                for i, transaction in enumerate(block.transactions):
+                    yield (height, i), transaction
+            self.height = height + 1
+            self.tick()
+        if self.height == 0 and self.failed is None:
+            self.fail(0, 'Empty chain')
+
+    def result(self, checkpoint: Optional[Checkpoint] = None) -> VerifyResult:
+        if self.failed is not None:
+            height, reason = self.failed
+            return VerifyResult(False, self.progress()._replace(height=height), reason)
+        return VerifyResult(True, self.progress(), checkpoint=checkpoint)
+
+
+def _start(path: Path) -> Tuple[int, Optional[str]]:
+    # where verification of a pruned store starts: after the blocks covered by its snapshot,
+    # which vouches for them. raises ValueError without a valid and trusted one
+    if not BlockStore.is_store(path):
+        return 0, None
+    s = snapshot.load(path)
+    store = BlockStore(path)
+    try:
+        if store.pruned_height == 0:
+            return 0, None
+        if s is None or not store.pruned_height <= s.height <= store.height \
+                or store.read_seal(s.height - 1).b64_hash != s.b64_hash or not snapshot.is_trusted(s):
+            raise ValueError('The chain is pruned and its snapshot is missing, invalid or not trusted')
+        return store.pruned_height, store.read_seal(store.pruned_height - 1).b64_hash
+    finally:
+        store.close()
+
+
+def verify(
+        path: Path,
+        jobs: int = 1,
+        on_progress: Optional[Callable[[Progress], None]] = None,
+        interval: float = 1.,
+        headers_only: bool = False,
+) -> VerifyResult:
+    # with headers_only, only the links and the proof of work of the blocks are checked,
+    # their bodies are left for a full verification later
+    stream = _Stream(on_progress, interval)
+    if headers_only:
+        for _ in stream.checked(iter_headers(path)):
+            pass
+        return stream.result()  # no checkpoint, it stands for fully verified blocks
+
+    try:
+        start, b64_prev_hash = _start(path)
+    except ValueError as e:
+        return VerifyResult(False, stream.progress(), str(e))
+    transactions = stream.checked(iter_blocks(path, start), start, b64_prev_hash)
+    verified = signatures.iter_verified(transactions, jobs=jobs)
+    try:
+        for (height, i), valid in verified:
+            if not valid:
+                stream.fail(height, f'Invalid signature of transaction {i}')
+                break
+            stream.transactions += 1
+            stream.tick()
+    finally:
+        verified.close()
+    return stream.result(stream.checkpoint)
@@ -0,0 +1,155 @@
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .chain import Chain
+
+
+# Summary of a chain file kept next to it: length, tip hash, validity and balances of the
+# mined blocks. It holds while the chain file is unchanged (same size and modification
+# time), so that read-only queries are answered without loading or verifying the chain.
+# Only the standard library is imported here, the chain modules are loaded by refresh().
+
+class Summary(NamedTuple):
+    stamp: Tuple[int, int]  # size and modification time (ns) of the chain file
+    length: int
+    height: int  # number of mined blocks
+    first_block: str
+    b64_tip_hash: Optional[str]  # hash of the last mined block
+    valid: bool
+    ledger: Optional[Dict]  # Ledger.todict() of the mined blocks, None if not valid
+    b64_snapshot_signer: Optional[str]  # signer of the snapshot next to the chain, if any
+    snapshot_trusted: bool  # whether that signer was trusted, the validity may depend on it
+
+    @property
+    def last_block_mined(self) -> bool:
+        return self.height == self.length
+
+    def balance(self, b64_address: str) -> Tuple[int, int, int]:
+        assert self.valid
+        account = self.ledger['balances'].get(b64_address, [0, 0, 0])
+        return account[0], account[1], account[2]
+
+    def info(self) -> Dict:
+        # same as Chain.info over all blocks, with the validity
+        res = {
+            'length': self.length,
+            'first_block': self.first_block,
+            'last_block_mined': self.last_block_mined,
+            'valid': self.valid,
+        }
+        if self.valid:
+            res['subchain_length'] = self.length
+            res['balances'] = {address: list(account) for address, account in self.ledger['balances'].items()}
+        return res
+
+    def todict(self) -> Dict:
+        return {
+            'stamp': list(self.stamp),
+            'length': self.length,
+            'height': self.height,
+            'first_block': self.first_block,
+            'tip_hash': self.b64_tip_hash,
+            'valid': self.valid,
+            'ledger': self.ledger,
+            'snapshot_signer': self.b64_snapshot_signer,
+            'snapshot_trusted': self.snapshot_trusted,
+        }
+
+    @staticmethod
+    def fromdict(d: Dict) -> 'Summary':
+        size, mtime = d['stamp']
+        return Summary((int(size), int(mtime)), int(d['length']), int(d['height']), str(d['first_block']),
+                       d['tip_hash'], bool(d['valid']), d['ledger'],
+                       d['snapshot_signer'], bool(d['snapshot_trusted']))
+
+    @staticmethod
+    def fromchain(
+            c: 'Chain', valid: bool, stamp: Tuple[int, int],
+            b64_snapshot_signer: Optional[str] = None, snapshot_trusted: bool = False,
+    ) -> 'Summary':
+        from . import store
+        height = c.length if c.last_block.is_mined else c.length - 1
+        return Summary(
+            stamp=stamp,
+            length=c.length,
+            height=height,
+            first_block=store.header(c, 0).b64_hash,
+            b64_tip_hash=store.header(c, height - 1).b64_hash if height > 0 else None,
+            valid=valid,
+            ledger=c.ledger.todict() if valid else None,
+            b64_snapshot_signer=b64_snapshot_signer,
+            snapshot_trusted=snapshot_trusted,
+        )
+
+
+def path_for(p_chain: Path) -> Path:
+    return p_chain.with_name(p_chain.name + '.summary')
+
+
+def stamp_of(p_chain: Path) -> Tuple[int, int]:
+    st = os.stat(p_chain)
+    return st.st_size, st.st_mtime_ns
+
+
+def load(p_chain: Path) -> Optional[Summary]:
+    # the summary last saved, whether or not the chain changed since
+    try:
+        with open(path_for(p_chain), 'r') as f:
+            return Summary.fromdict(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save(p_chain: Path, s: Summary) -> None:
+    with open(path_for(p_chain), 'w') as f:
+        json.dump(s.todict(), f)
+
+
+def matches(c: 'Chain', s: Summary) -> bool:
+    # the chain still holds the mined blocks summarised, maybe followed by new ones
+    from . import store
+    if not 0 < s.height <= c.length:
+        return False
+    header = store.header(c, s.height - 1)
+    return header.is_mined and header.b64_hash == s.b64_tip_hash and store.hashes_match(c, s.height)
+
+
+def refresh(p_chain: Path, jobs: int = 1) -> Summary:
+    # load and verify the chain (from its checkpoint), balances go on from the previous
+    # summary if the chain only grew since
+    from . import checkpoint, snapshot, store
+    from .chain import MINING_REWARD
+    from .ledger import Ledger
+    previous = load(p_chain)
+    stamp = stamp_of(p_chain)  # before reading, a concurrent write leaves the summary stale
+    s_snapshot = snapshot.load(p_chain)
+    c = store.load(p_chain)
+    valid = checkpoint.verify(c, p_chain, jobs=jobs)
+    if valid and previous is not None and previous.valid and previous.ledger['mining_reward'] == MINING_REWARD \
+            and previous.height > (c.base.height if c.base is not None else 0) and matches(c, previous):
+        c.restore(Ledger.fromdict(previous.ledger))
+    if s_snapshot is None:
+        s = Summary.fromchain(c, valid, stamp)
+    else:
+        b64_signer = s_snapshot.b64_signer
+        s = Summary.fromchain(c, valid, stamp, b64_signer, b64_signer in snapshot.trusted_signers)
+    save(p_chain, s)
+    return s
+
+
+def _same_trust(s: Summary) -> bool:
+    # the signer of the snapshot is as trusted as when the summary was made
+    if s.b64_snapshot_signer is None:
+        return True
+    from . import snapshot
+    return (s.b64_snapshot_signer in snapshot.trusted_signers) == s.snapshot_trusted
+
+
+def current(p_chain: Path, jobs: int = 1) -> Summary:
+    s = load(p_chain)
+    if s is not None and s.stamp == stamp_of(p_chain) and _same_trust(s):
+        return s
+    return refresh(p_chain, jobs=jobs)
@@ -0,0 +1,349 @@
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from . import signatures, store
+from .block import Block, BlockHeader
+from .chain import Chain
+from .node import Node, NodeError, DEFAULT_HOST, MAX_BLOCKS, MAX_HEADERS, parse_address
+
+
+# Block sync between nodes. The common ancestor with every peer is found by block hash,
+# then only the missing blocks are fetched:
+#   1. headers from the longest peer, checked for links and proof of work
+#   2. bodies in batches from all peers that share our tip, several requests in flight per
+#      connection, each block checked against its header as it arrives
+#   3. signatures verified by `jobs` processes while the download goes on, then blocks are
+#      appended in order through Chain.add_block
+# Peers that fail or send blocks that do not match the headers are dropped and their
+# batches fetched from the others. A chain that diverged from the peers is not synced.
+
+DEFAULT_BATCH_SIZE = 8  # blocks per request
+DEFAULT_DEPTH = 4  # requests in flight per peer
+LOCATOR_DENSE = 10  # locator heights right below the tip, the rest are spaced exponentially
+STREAM_LIMIT = 1 << 28  # longest response line
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncResult(NamedTuple):
+    blocks: int  # appended
+    transactions: int
+    seconds: float
+    peers: int  # that served blocks
+    error: Optional[str] = None  # why the sync stopped early, the blocks before are appended
+
+    @property
+    def blocks_per_sec(self) -> float:
+        return self.blocks / self.seconds if self.seconds > 0 else 0.
+
+    @property
+    def transactions_per_sec(self) -> float:
+        return self.transactions / self.seconds if self.seconds > 0 else 0.
+
+
+class Peer:
+    # connection to a node whose requests are pipelined: they are written without
+    # waiting for the responses to the previous ones
+    def __init__(
+            self,
+            address: str,
+    ) -> None:
+        self.address = address
+        self.length = 0  # mined blocks of the peer
+        self.common = -1  # height of the last block shared with us
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._id = 0
+        self._reading: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        reader, self._writer = await asyncio.open_connection(*parse_address(self.address), limit=STREAM_LIMIT)
+        self._reading = asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        # however reading ends, every request still pending fails
+        error = NodeError(f'Connection to {self.address} closed')
+        try:
+            while line := await reader.readline():
+                response = json.loads(line)
+                if not isinstance(response, dict) or not isinstance(response.get('id'), (int, type(None))) \
+                        or ('result' not in response and 'error' not in response):
+                    raise ValueError(f'Malformed response {line[:80]!r}')
+                future = self._pending.pop(response['id'], None)
+                if future is None or future.done():
+                    continue
+                if 'error' in response:
+                    future.set_exception(NodeError(response['error']))
+                else:
+                    future.set_result(response['result'])
+            error = NodeError(f'Connection closed by {self.address}')
+        except (OSError, ValueError) as e:
+            error = NodeError(f'Connection to {self.address} failed: {e}')
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._pending.clear()
+
+    async def call(self, method: str, **params):
+        if self._reading is None or self._reading.done():
+            raise NodeError(f'Not connected to {self.address}')
+        self._id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[self._id] = future
+        self._writer.write(json.dumps({'id': self._id, 'method': method, 'params': params}).encode() + b'\n')
+        await self._writer.drain()
+        return await future
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        if self._reading is not None:
+            self._reading.cancel()
+
+
+def mined_length(c: Chain) -> int:
+    return c.length if c.last_block.is_mined else c.length - 1
+
+
+def locator(c: Chain) -> List[Tuple[int, str]]:
+    # (height, hash) of some of our blocks from the tip down: the last ones, then
+    # exponentially further apart, ending with the genesis block
+    heights = []
+    height, step = mined_length(c) - 1, 1
+    while height > 0:
+        heights.append(height)
+        if len(heights) >= LOCATOR_DENSE:
+            step *= 2
+        height -= step
+    heights.append(0)
+    return [(height, store.header(c, height).b64_hash) for height in heights]
+
+
+async def common_ancestor(peer: Peer, c: Chain) -> int:
+    # height of the last block we share with the peer, -1 if not even the genesis block.
+    # the locator brackets it, a bisection by hash finds it exactly
+    entries = locator(c)
+    located = await peer.call('locate', locator=entries)
+    peer.length = located['length']
+    common = located['common']
+    heights = [height for height, _ in entries]
+    if common < 0 or common == heights[0]:
+        return common
+    lo, hi = common, heights[heights.index(common) - 1]  # shared, not shared
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        located = await peer.call('locate', locator=[(mid, store.header(c, mid).b64_hash)])
+        if located['common'] == mid:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+async def fetch_headers(peer: Peer, start: int, stop: int) -> List[BlockHeader]:
+    requests = [peer.call('headers', start=height, count=min(MAX_HEADERS, stop - height))
+                for height in range(start, stop, MAX_HEADERS)]
+    headers = []
+    for batch in await asyncio.gather(*requests):
+        headers.extend(BlockHeader.fromdict(d) for d in batch)
+    if len(headers) != stop - start:
+        raise NodeError(f'{peer.address} sent {len(headers)} headers instead of {stop - start}')
+    return headers
+
+
+def check_headers(headers: List[BlockHeader], b64_prev_hash: str) -> Optional[int]:
+    # index of the first header that does not link up or lacks the proof of work, None if all are valid
+    for i, header in enumerate(headers):
+        if header.b64_prev_hash != b64_prev_hash or not header.is_mined or not header.is_proved:
+            return i
+        b64_prev_hash = header.b64_hash
+    return None
+
+
+class _Download:
+    def __init__(
+            self,
+            c: Chain,
+            start: int,
+            headers: List[BlockHeader],
+            executor: Optional[concurrent.futures.Executor],
+            batch_size: int,
+            on_progress: Optional[Callable[[int], None]],
+    ) -> None:
+        self.chain = c
+        self.start = start
+        self.headers = headers  # of heights start...
+        self.executor = executor
+        self.on_progress = on_progress
+        self.batches = [(height, min(batch_size, start + len(headers) - height))
+                        for height in range(start, start + len(headers), batch_size)]
+        self.verified: Dict[int, List[Block]] = {}  # by height of their first block, waiting to be appended
+        self.next_height = start
+        self.transactions = 0
+        self.served: Dict[str, int] = {}  # blocks per peer address
+        self.error: Optional[str] = None
+
+    def _take(self, peer: Peer) -> Optional[Tuple[int, int]]:
+        for i, (height, count) in enumerate(self.batches):
+            if height + count <= peer.length:
+                return self.batches.pop(i)
+        return None
+
+    def _parse(self, height: int, dicts: List[Dict]) -> List[Block]:
+        # blocks that match their headers, the hash covers their transactions
+        res = []
+        for i, d in enumerate(dicts):
+            header = self.headers[height + i - self.start]
+            block = Block.fromdict(d, b64_prev_hash=header.b64_prev_hash)
+            if block.b64_hash != header.b64_hash or not block.merkle_tree.verify(check_signatures=False):
+                raise NodeError(f'Block {height + i} does not match its header')
+            res.append(block)
+        return res
+
+    def _append(self) -> None:
+        while self.next_height in self.verified:
+            for block in self.verified.pop(self.next_height):
+                self.chain.add_block(block, check_signatures=False)
+                self.transactions += len(block.transactions)
+                self.next_height += 1
+        if self.on_progress is not None:
+            self.on_progress(self.next_height)
+
+    async def _worker(self, peer: Peer, dropped: List[Peer]) -> None:
+        loop = asyncio.get_running_loop()
+        while self.error is None and peer not in dropped:
+            batch = self._take(peer)
+            if batch is None:
+                return
+            height, count = batch
+            try:
+                blocks = self._parse(height, await peer.call('blocks', start=height, count=count))
+                if len(blocks) != count:
+                    raise NodeError(f'{peer.address} sent {len(blocks)} blocks instead of {count}')
+            except (NodeError, OSError, ValueError, KeyError, TypeError, AssertionError):
+                self.batches.append(batch)  # for the other peers
+                if peer not in dropped:
+                    dropped.append(peer)
+                return
+            transactions = [t for block in blocks for t in block.transactions]
+            valid = await loop.run_in_executor(self.executor, signatures.verify_all, transactions)
+            if not all(valid):
+                # the block hashes to what the headers say, so the chain itself is invalid
+                invalid = valid.index(False)
+                for i, block in enumerate(blocks):
+                    if invalid < len(block.transactions):
+                        self.error = f'Invalid signature in block {height + i}'
+                        break
+                    invalid -= len(block.transactions)
+                return
+            self.served[peer.address] = self.served.get(peer.address, 0) + count
+            self.verified[height] = blocks
+            self._append()
+
+    async def run(self, peers: List[Peer], depth: int) -> None:
+        dropped: List[Peer] = []
+        while self.batches and self.error is None:
+            live = [peer for peer in peers if peer not in dropped]
+            if not any(self._take_possible(peer) for peer in live):
+                self.error = 'No peer left to download from'
+                return
+            # interleaved, so that the first batches go to different peers
+            await asyncio.gather(*[self._worker(peer, dropped) for _ in range(depth) for peer in live])
+
+    def _take_possible(self, peer: Peer) -> bool:
+        return any(height + count <= peer.length for height, count in self.batches)
+
+
+async def sync(
+        c: Chain,
+        addresses: List[str],
+        jobs: int = 1,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        depth: int = DEFAULT_DEPTH,
+        on_progress: Optional[Callable[[int], None]] = None,
+) -> SyncResult:
+    # append to `c` the blocks the peers have beyond its mined blocks, which must be its last ones
+    assert c.last_block.is_mined, 'Open block must be mined or dropped before syncing'
+    assert 0 < batch_size <= MAX_BLOCKS and depth > 0
+    started = time.perf_counter()
+    start = mined_length(c)
+    peers = [Peer(address) for address in addresses]
+    executor = concurrent.futures.ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context()) \
+        if jobs > 1 else None
+    try:
+        reachable = []
+        for peer, result in zip(peers, await asyncio.gather(*[_connect(peer, c) for peer in peers],
+                                                            return_exceptions=True)):
+            if isinstance(result, BaseException):
+                if not isinstance(result, (NodeError, OSError)):
+                    raise result
+            else:
+                reachable.append(peer)
+        if not reachable:
+            raise SyncError('No peer reachable')
+
+        best = max(reachable, key=lambda p: p.length)
+        if best.common < start - 1:
+            raise SyncError(f'Diverged from {best.address} after height {best.common}')
+        if best.length <= start:
+            return SyncResult(0, 0, time.perf_counter() - started, 0)
+
+        headers = await fetch_headers(best, start, best.length)
+        invalid = check_headers(headers, c.last_block.b64_hash)
+        if invalid is not None:
+            raise SyncError(f'Invalid header of block {start + invalid} from {best.address}')
+        sources = [peer for peer in reachable if peer.common == start - 1]
+        download = _Download(c, start, headers, executor, batch_size, on_progress)
+        await download.run(sources, depth)
+        return SyncResult(
+            blocks=download.next_height - start,
+            transactions=download.transactions,
+            seconds=time.perf_counter() - started,
+            peers=len(download.served),
+            error=download.error,
+        )
+    finally:
+        await asyncio.gather(*[peer.close() for peer in peers])
+        if executor is not None:
+            executor.shutdown()
+
+
+async def _connect(peer: Peer, c: Chain) -> None:
+    await peer.open()
+    peer.common = await common_ancestor(peer, c)
+
+
+################################################################################
+#  Local peers, for benchmarks
+################################################################################
+
+def serve_peer(p_chain: Path, ready: multiprocessing.Queue) -> None:
+    # serve a chain on a free local port, which is put on the `ready` queue
+    async def main() -> None:
+        n = Node.load(p_chain)
+        server = await asyncio.start_server(n.handle, DEFAULT_HOST, 0)
+        ready.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def start_peers(paths: List[Path], timeout: float = 60.) -> Tuple[List[multiprocessing.Process], List[str]]:
+    ctx = multiprocessing.get_context()
+    processes, addresses = [], []
+    for p_chain in paths:
+        ready = ctx.Queue()
+        process = ctx.Process(target=serve_peer, args=(p_chain, ready), daemon=True)
+        process.start()
+        processes.append(process)
+        addresses.append(f'{DEFAULT_HOST}:{ready.get(timeout=timeout)}')
+    return processes, addresses
@@ -1,13 +1,19 @@
-import datetime
-from typing import Optional
+import hashlib
+import sys
+from typing import Dict, Optional, Union
 
 import rsa
 import base64
 
-from . import wallet
+from . import keycache, profiling, wallet
+from .encoding import b64_compact, b64_expand, timestamp_compact, timestamp_expand, timestamp_now
 
 
 class Transaction:
+    # fields are kept in compact form (raw bytes, integer timestamp, interned key),
+    # the text forms are produced on access
+    __slots__ = ('_sender', '_receiver', '_amount', '_signature', '_sender_pk', '_timestamp')
+
     def __init__(
             self,
             b64_sender: str,
@@ -15,25 +21,65 @@ class Transaction:
             amount: int,
             b64_signature: Optional[str] = None,
             str_sender_pk: Optional[str] = None,
-            timestamp: Optional[int] = None,
+            timestamp: Union[str, int, None] = None,
     ) -> None:
         assert amount > 0
 
-        self.b64_sender = b64_sender
-        self.b64_receiver = b64_receiver
+        self._sender = b64_compact(b64_sender)
+        self._receiver = b64_compact(b64_receiver)
         self._amount = amount
         self.b64_signature = b64_signature
         self.str_sender_pk = str_sender_pk
-        self.timestamp = timestamp if timestamp is not None else datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._timestamp = timestamp_compact(timestamp) if timestamp is not None else timestamp_now()
+
+    @property
+    def b64_sender(self) -> str:
+        return b64_expand(self._sender)
+
+    @property
+    def b64_receiver(self) -> str:
+        return b64_expand(self._receiver)
 
     @property
     def amount(self) -> int:
         return self._amount
 
+    @property
+    def timestamp(self) -> str:
+        return timestamp_expand(self._timestamp)
+
+    @property
+    def b64_signature(self) -> Optional[str]:
+        return b64_expand(self._signature)
+
+    @b64_signature.setter
+    def b64_signature(self, b64_signature: Optional[str]) -> None:
+        self._signature = b64_compact(b64_signature)
+
+    @property
+    def signature(self) -> Optional[bytes]:
+        if isinstance(self._signature, str):
+            return base64.b64decode(self._signature.encode())
+        return self._signature
+
+    @property
+    def str_sender_pk(self) -> Optional[str]:
+        return self._sender_pk
+
+    @str_sender_pk.setter
+    def str_sender_pk(self, str_sender_pk: Optional[str]) -> None:
+        # a sender signs many transactions, share one copy of its key
+        self._sender_pk = sys.intern(str_sender_pk) if str_sender_pk is not None else None
+
     @property
     def signable_str(self) -> str:
         return f"{self.b64_sender} {self.b64_receiver} {self.amount} {self.timestamp}"
 
+    @property
+    def b64_hash(self) -> str:
+        # identifies the signed transaction, independent of the block it ends up in
+        return base64.b64encode(hashlib.sha256(f"{self.signable_str} {self.b64_signature}".encode()).digest()).decode()
+
     def sign(self, w: wallet.Wallet) -> None:
         assert self.b64_sender == w.b64_address, 'Only sender can sign transaction'
 
@@ -42,17 +88,44 @@ class Transaction:
 
     @property
     def is_signed(self) -> bool:
-        return self.b64_signature is not None
+        return self._signature is not None
+
+    @property
+    def is_signed_by_sender(self) -> bool:
+        # signed with a key owned by the sender, anyone can sign a transfer with their own key
+        try:
+            return self.is_signed and keycache.address(self.str_sender_pk) == self.b64_sender
+        except (AttributeError, ValueError):
+            return False
 
     @property
     def sender_pk(self) -> rsa.PublicKey:
-        return rsa.PublicKey(*[int(i) for i in self.str_sender_pk.split()])
+        return keycache.public_key(self.str_sender_pk)
 
     def verify_signature(self) -> bool:
-        if not self.is_signed:
-            return False
-        try:
-            rsa.verify(self.signable_str.encode(), base64.b64decode(self.b64_signature.encode()), self.sender_pk)
-            return True
-        except rsa.VerificationError:
+        if not self.is_signed_by_sender:
             return False
+        if profiling.ENABLED:
+            profiling.count('signatures.verified')
+        return keycache.verify(self.signable_str.encode(), self.signature, self.str_sender_pk)
+
+    def todict(self) -> Dict:
+        return {
+            'timestamp': self.timestamp,
+            'sender': self.b64_sender,
+            'receiver': self.b64_receiver,
+            'amount': self.amount,
+            'sender_pk': self.str_sender_pk,
+            'signature': self.b64_signature
+        }
+
+    @staticmethod
+    def fromdict(d: Dict) -> 'Transaction':
+        return Transaction(
+            b64_sender=d['sender'],
+            b64_receiver=d['receiver'],
+            amount=d['amount'],
+            b64_signature=d['signature'],
+            str_sender_pk=d['sender_pk'],
+            timestamp=d['timestamp'],
+        )
@@ -1,10 +1,14 @@
+import json
+import multiprocessing
 from pathlib import Path
+from typing import Dict, List
 
-import base64
-from hashlib import sha256
 from rsa import PublicKey, PrivateKey, newkeys
 
+from . import keycache
+
 N_BITS = 512
+INDEX_NAME = 'index.json'  # address index of a wallet directory
 
 
 class Wallet:
@@ -15,7 +19,7 @@ class Wallet:
         self.sk = sk
         self.pk = PublicKey(sk.n, sk.e)
         self.str_pk = f"{self.pk.n} {self.pk.e}"
-        self.b64_address = base64.b64encode(sha256(self.str_pk.encode('ascii')).digest()).decode()
+        self.b64_address = keycache.address(self.str_pk)
 
     def to_file(self, path: Path) -> None:
         with open(path, 'wb') as f:
@@ -33,3 +37,67 @@ class Wallet:
         sk = PrivateKey.load_pkcs1(key_data)
         return Wallet(sk)
 
+    @staticmethod
+    def from_keystore(path: Path, b64_address: str) -> 'Wallet':
+        # read only the key of the address, located through the keystore index
+        offset, length = load_index(path)[b64_address]
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return Wallet(PrivateKey.load_pkcs1(f.read(length)))
+
+
+################################################################################
+#  Batches
+################################################################################
+
+def _new_key(_) -> PrivateKey:
+    return newkeys(N_BITS)[1]
+
+
+def generate_batch(count: int, jobs: int = 1) -> List[Wallet]:
+    # key generation is a pure-Python prime search, whole keys are spread over `jobs` processes
+    assert count >= 0 and jobs > 0
+    if jobs == 1:
+        return [Wallet.generate() for _ in range(count)]
+    with multiprocessing.get_context().Pool(jobs) as pool:
+        return [Wallet(sk) for sk in pool.imap(_new_key, range(count), chunksize=max(1, count // (jobs * 4)))]
+
+
+def index_path(dest: Path) -> Path:
+    # the index of a directory is inside it, the index of a keystore file next to it
+    return dest / INDEX_NAME if dest.is_dir() else dest.with_name(dest.name + '.index')
+
+
+def batch_exists(dest: Path) -> bool:
+    # whether saving a batch to `dest` would overwrite keys or an index
+    return dest.exists() or index_path(dest).exists()
+
+
+def save_batch(wallets: List[Wallet], dest: Path, keystore: bool = False, force: bool = False) -> None:
+    # one PKCS#1 file per wallet in directory `dest`, or all keys one after another in keystore file `dest`.
+    # the index maps every address to its wallet file, or to the (offset, length) of its key in the keystore.
+    # existing files are only overwritten with `force`, otherwise FileExistsError is raised
+    if not force and batch_exists(dest):
+        raise FileExistsError(f'{dest} or its index already exists')
+    mode = 'w' if force else 'x'
+    index: Dict[str, object] = {}
+    if keystore:
+        with open(dest, mode + 'b') as f:
+            for w in wallets:
+                key = w.sk.save_pkcs1()
+                index[w.b64_address] = (f.tell(), len(key))
+                f.write(key)
+    else:
+        dest.mkdir(parents=True, exist_ok=force)
+        for i, w in enumerate(wallets):
+            name = f'wallet-{i}.wal'
+            with open(dest / name, mode + 'b') as f:
+                f.write(w.sk.save_pkcs1())
+            index[w.b64_address] = name
+    with open(index_path(dest), mode) as f:
+        json.dump(index, f)
+
+
+def load_index(dest: Path) -> Dict:
+    with open(index_path(dest), 'r') as f:
+        return json.load(f)